@@ -1,47 +1,145 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 import uuid
-from database import Database
+from database import Database, SYMPTOM_COLUMNS
+from catalog import GhostCatalog
 from models import *
 
 app = Flask(__name__)
 CORS(app)
 db = Database()
+catalog = GhostCatalog(db)
+
+def catalog_response(snapshot, body):
+    """Serve a cached catalog body, or a 304 if the client already has this version"""
+    headers = {'ETag': f'"{snapshot.etag}"'}
+    if request.if_none_match.contains(snapshot.etag):
+        return '', 304, headers
+    return Response(body, status=200, headers=headers, mimetype='application/json')
 
 # API Routes
 @app.route('/ghosts', methods=['GET'])
 def get_ghosts():
-    """Get all ghost types"""
+    """Get all ghost types (ETag is the catalog version), or those matching ?symptom=&tier= filters"""
     try:
-        ghosts = db.get_ghosts()
-        
-        response = {
-            'ghosts': [{
-                'id': ghost.id,
-                'name': ghost.name,
-                'typeASymptoms': ghost.type_a_symptoms
-            } for ghost in ghosts]
-        }
+        symptoms = request.args.getlist('symptom')
+        if symptoms:
+            tiers = [tier.lower() for tier in request.args.getlist('tier')] or list(SYMPTOM_COLUMNS)
+            if any(tier not in SYMPTOM_COLUMNS for tier in tiers):
+                return jsonify({'error': 'tier must be one of a, b, c'}), 400
+            
+            # Filters are answered by the database so large catalogs need not be held in memory
+            ghosts = db.find_ghosts(symptoms, tiers)
+            return jsonify({
+                'ghosts': [{
+                    'id': ghost.id,
+                    'name': ghost.name,
+                    'typeASymptoms': ghost.type_a_symptoms
+                } for ghost in ghosts]
+            }), 200
         
-        return jsonify(response), 200
+        snapshot = catalog.get()
+        return catalog_response(snapshot, snapshot.body)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/ghosts/<ghost_id>', methods=['GET'])
 def get_ghost(ghost_id):
-    """Get ghost by ID"""
+    """Get ghost by ID (ETag is the catalog version)"""
     try:
-        ghost = db.get_ghost(ghost_id)
-        if not ghost:
+        snapshot = catalog.get()
+        body = snapshot.ghost_body(ghost_id)
+        if body is None:
             return jsonify({'error': 'Ghost not found'}), 404
         
+        return catalog_response(snapshot, body)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def valid_symptom_list(value) -> bool:
+    return isinstance(value, list) and all(isinstance(symptom, str) for symptom in value)
+
+@app.route('/ghosts/identify', methods=['POST'])
+def identify_ghosts():
+    """Rank ghosts by how well they fit observed symptoms, for one or a batch of observation sets"""
+    try:
+        data = request.get_json()
+        req = IdentifyGhostRequest(**data)
+        
+        if req.limit is not None and (not isinstance(req.limit, int) or req.limit < 1):
+            return jsonify({'error': 'limit must be a positive integer'}), 400
+        
+        observations = req.observations if req.observations is not None else [
+            {'symptoms': req.symptoms, 'excluded': req.excluded}
+        ]
+        if not isinstance(observations, list) or not all(isinstance(o, dict) for o in observations):
+            return jsonify({'error': 'observations must be a list of objects'}), 400
+        for observation in observations:
+            if not valid_symptom_list(observation.get('symptoms', [])) \
+                    or not valid_symptom_list(observation.get('excluded', [])):
+                return jsonify({'error': 'symptoms and excluded must be lists of strings'}), 400
+        
+        # Score every observation set against the same catalog version
+        snapshot = catalog.get()
+        results = [
+            snapshot.identify(o.get('symptoms', []), o.get('excluded', []), req.limit)
+            for o in observations
+        ]
+        
+        if req.observations is None:
+            response = results[0]
+        else:
+            response = {'results': results}
+        response['catalogVersion'] = snapshot.version
+        
+        return jsonify(response), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/ghosts/infer', methods=['POST'])
+def infer_ghosts():
+    """Posterior probability of every ghost for a batch of journals"""
+    try:
+        data = request.get_json()
+        req = InferGhostRequest(**data)
+        
+        if not isinstance(req.journals, list) or not all(isinstance(j, dict) for j in req.journals):
+            return jsonify({'error': 'journals must be a list of objects'}), 400
+        for journal in req.journals:
+            if not valid_symptom_list(journal.get('symptoms', [])) \
+                    or not valid_symptom_list(journal.get('excluded', [])):
+                return jsonify({'error': 'symptoms and excluded must be lists of strings'}), 400
+        
+        snapshot = catalog.get()
+        ghost_ids = [ghost.id for ghost in snapshot.ghosts]
+        if not ghost_ids or not req.journals:
+            return jsonify({'catalogVersion': snapshot.version, 'ghostIds': ghost_ids,
+                            'posteriors': [], 'mostLikely': []}), 200
+        
+        model = snapshot.model
+        posteriors = model.posteriors(model.encode(
+            [(j.get('symptoms', []), j.get('excluded', [])) for j in req.journals]
+        ))
+        
         response = {
-            'id': ghost.id,
-            'name': ghost.name,
-            'typeASymptoms': ghost.type_a_symptoms
+            'catalogVersion': snapshot.version,
+            'ghostIds': ghost_ids,
+            'posteriors': posteriors.round(6).tolist(),
+            'mostLikely': [ghost_ids[g] for g in posteriors.argmax(axis=1).tolist()]
         }
         
+        # Probability of the ghost each journal was submitted with, for guess checks
+        if any('guess' in journal for journal in req.journals):
+            columns = {ghost_id: g for g, ghost_id in enumerate(ghost_ids)}
+            response['guessProbabilities'] = [
+                round(float(posteriors[j, columns[journal['guess']]]), 6)
+                if journal.get('guess') in columns else None
+                for j, journal in enumerate(req.journals)
+            ]
+        
         return jsonify(response), 200
         
     except Exception as e:
@@ -55,8 +153,13 @@ def create_ghost():
         req = CreateGhostRequest(**data)
         
         # Validate input
-        if not req.name:
+        if not isinstance(req.name, str) or not req.name:
             return jsonify({'error': 'Ghost name is required'}), 400
+        if not all(valid_symptom_list(symptoms) for symptoms in
+                   [req.type_a_symptoms, req.type_b_symptoms, req.type_c_symptoms]):
+            return jsonify({'error': 'Symptoms must be lists of strings'}), 400
+        if req.name in catalog.get().by_name:
+            return jsonify({'error': 'Ghost name already exists'}), 409
         
         # Create ghost
         ghost_id = db.generate_uuid()
@@ -69,12 +172,61 @@ def create_ghost():
         )
         
         db.create_ghost(ghost)
+        catalog.load()
         
         return jsonify({'id': ghost_id}), 201
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/ghosts/bulk', methods=['POST'])
+def bulk_upsert_ghosts():
+    """Create or replace a whole catalog of ghosts by name in one transaction"""
+    try:
+        data = request.get_json()
+        req = BulkGhostsRequest(**data)
+        
+        if not isinstance(req.ghosts, list) or not all(isinstance(g, dict) for g in req.ghosts):
+            return jsonify({'error': 'ghosts must be a list of objects'}), 400
+        
+        ghosts = []
+        names = set()
+        for entry in req.ghosts:
+            ghost_req = CreateGhostRequest(**entry)
+            if not isinstance(ghost_req.name, str) or not ghost_req.name:
+                return jsonify({'error': 'Ghost name is required'}), 400
+            if not all(valid_symptom_list(symptoms) for symptoms in
+                       [ghost_req.type_a_symptoms, ghost_req.type_b_symptoms, ghost_req.type_c_symptoms]):
+                return jsonify({'error': f'Symptoms of {ghost_req.name} must be lists of strings'}), 400
+            if ghost_req.name in names:
+                return jsonify({'error': f'Ghost {ghost_req.name} is listed more than once'}), 400
+            names.add(ghost_req.name)
+            ghosts.append(Ghost(
+                id=db.generate_uuid(),
+                name=ghost_req.name,
+                type_a_symptoms=ghost_req.type_a_symptoms,
+                type_b_symptoms=ghost_req.type_b_symptoms,
+                type_c_symptoms=ghost_req.type_c_symptoms
+            ))
+        
+        written = db.upsert_ghosts(ghosts) if ghosts else []
+        # One reload for the whole import, and none if nothing changed
+        if written:
+            catalog.load()
+        
+        created = sum(1 for _, _, inserted in written if inserted)
+        return jsonify({
+            'created': created,
+            'updated': len(written) - created,
+            'unchanged': len(ghosts) - len(written),
+            'ghosts': [{'id': ghost_id, 'name': name, 'created': inserted}
+                       for ghost_id, name, inserted in written],
+            'catalogVersion': catalog.get().version
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/ghosts/<ghost_id>', methods=['PATCH'])
 def update_ghost(ghost_id):
     """Update ghost type"""
@@ -83,9 +235,16 @@ def update_ghost(ghost_id):
         req = UpdateGhostRequest(**data)
         
         # Check if ghost exists
-        existing_ghost = db.get_ghost(ghost_id)
-        if not existing_ghost:
+        if ghost_id not in catalog.get().by_id:
             return jsonify({'error': 'Ghost not found'}), 404
+        if req.name is not None and (not isinstance(req.name, str) or not req.name):
+            return jsonify({'error': 'Ghost name must be a non-empty string'}), 400
+        if not all(symptoms is None or valid_symptom_list(symptoms) for symptoms in
+                   [req.type_a_symptoms, req.type_b_symptoms, req.type_c_symptoms]):
+            return jsonify({'error': 'Symptoms must be lists of strings'}), 400
+        existing_name = catalog.get().by_name.get(req.name)
+        if existing_name is not None and existing_name.id != ghost_id:
+            return jsonify({'error': 'Ghost name already exists'}), 409
         
         # Prepare update data
         update_data = {}
@@ -100,9 +259,10 @@ def update_ghost(ghost_id):
         
         # Update ghost
         db.update_ghost(ghost_id, update_data)
+        catalog.load()
         
         # Return updated ghost
-        updated_ghost = db.get_ghost(ghost_id)
+        updated_ghost = catalog.get().by_id[ghost_id]
         
         return jsonify({
             'id': updated_ghost.id,
@@ -0,0 +1,144 @@
+import threading
+import json
+import uuid
+from inference import GhostModel
+
+class SymptomIndex:
+    """Symptoms interned to bit positions, with bitsets in both directions.
+
+    ghost_bits[g] has a bit for every symptom ghost g shows in any tier, and
+    symptom_ghosts[s] has a bit for every ghost showing symptom s.
+    """
+
+    def __init__(self, ghosts):
+        self.symptom_ids = {}
+        self.ghost_bits = []
+        self.symptom_ghosts = []
+        for g, ghost in enumerate(ghosts):
+            bits = 0
+            for symptom in ghost.type_a_symptoms + ghost.type_b_symptoms + ghost.type_c_symptoms:
+                s = self.symptom_ids.get(symptom)
+                if s is None:
+                    s = self.symptom_ids[symptom] = len(self.symptom_ghosts)
+                    self.symptom_ghosts.append(0)
+                bits |= 1 << s
+                self.symptom_ghosts[s] |= 1 << g
+            self.ghost_bits.append(bits)
+
+    def encode(self, symptoms):
+        """Bitset of the known symptoms, and the list of unknown ones"""
+        bits = 0
+        unknown = []
+        for symptom in symptoms:
+            s = self.symptom_ids.get(symptom)
+            if s is None:
+                unknown.append(symptom)
+            else:
+                bits |= 1 << s
+        return bits, unknown
+
+    def consistent_ghosts(self, observed: int, excluded: int) -> int:
+        """Bitset of ghosts showing every observed symptom and none of the excluded ones"""
+        ghosts = (1 << len(self.ghost_bits)) - 1
+        for s in range(max(observed, excluded).bit_length()):
+            if observed >> s & 1:
+                ghosts &= self.symptom_ghosts[s]
+            elif excluded >> s & 1:
+                ghosts &= ~self.symptom_ghosts[s]
+        return ghosts
+
+class CatalogSnapshot:
+    """One version of the ghost catalog, with its response bodies.
+
+    Snapshots are never modified after being published, so readers can use
+    one without locking. The ETag combines a per-process generation with the
+    version, so a restarted service never reuses an old tag.
+    """
+
+    def __init__(self, generation: str, version: int, ghosts):
+        self.version = version
+        self.etag = f'{generation}-{version}'
+        self.ghosts = ghosts
+        self.by_id = {ghost.id: ghost for ghost in ghosts}
+        self.by_name = {ghost.name: ghost for ghost in ghosts}
+        self.symptoms = SymptomIndex(ghosts)
+        self.model = GhostModel(self.symptoms, ghosts)
+        self.body = json.dumps({
+            'ghosts': [self.summary(ghost) for ghost in ghosts]
+        }).encode()
+        self.ghost_bodies = {}  # ghost_id -> serialized ghost, filled on first read
+
+    def summary(self, ghost) -> dict:
+        return {
+            'id': ghost.id,
+            'name': ghost.name,
+            'typeASymptoms': ghost.type_a_symptoms
+        }
+
+    def ghost_body(self, ghost_id: str):
+        """Serialized ghost, or None if it is not in the catalog"""
+        body = self.ghost_bodies.get(ghost_id)
+        if body is None:
+            ghost = self.by_id.get(ghost_id)
+            if ghost is None:
+                return None
+            body = self.ghost_bodies[ghost_id] = json.dumps(self.summary(ghost)).encode()
+        return body
+
+    def identify(self, symptoms, excluded, limit: int = None) -> dict:
+        """Rank ghosts against observed and ruled-out symptoms.
+
+        A contradiction is an observed symptom the ghost does not show (every
+        unknown symptom counts against all ghosts) or a ruled-out symptom it
+        does show. Candidates come fewest contradictions first, then most
+        matches.
+        """
+        index = self.symptoms
+        observed, unknown = index.encode(symptoms)
+        ruled_out, _ = index.encode(excluded)
+        consistent = index.consistent_ghosts(observed, ruled_out) if not unknown else 0
+        observed_count = observed.bit_count() + len(unknown)
+
+        candidates = []
+        for g, ghost in enumerate(self.ghosts):
+            bits = index.ghost_bits[g]
+            matches = (bits & observed).bit_count()
+            candidates.append({
+                'id': ghost.id,
+                'name': ghost.name,
+                'matches': matches,
+                'contradictions': observed_count - matches + (bits & ruled_out).bit_count(),
+                'consistent': bool(consistent >> g & 1)
+            })
+        candidates.sort(key=lambda c: (c['contradictions'], -c['matches']))
+
+        return {
+            'candidates': candidates[:limit] if limit is not None else candidates,
+            'unknownSymptoms': unknown
+        }
+
+class GhostCatalog:
+    """The ghost catalog held in memory under a version counter.
+
+    Loaded at startup and reloaded after every write, so catalog reads never
+    touch the database.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.lock = threading.Lock()
+        self.generation = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.snapshot = None
+        self.load()
+
+    def load(self):
+        """Read the catalog from the database and publish it as a new version"""
+        with self.lock:
+            ghosts = self.db.get_ghosts()
+            self.version += 1
+            self.snapshot = CatalogSnapshot(self.generation, self.version, ghosts)
+            print(f"✅ Ghost catalog loaded: {len(ghosts)} ghosts, version {self.version}")
+
+    def get(self) -> CatalogSnapshot:
+        return self.snapshot
@@ -1,9 +1,18 @@
 import psycopg2
+import psycopg2.errors
 import json
-from psycopg2.extras import RealDictCursor
+import uuid
+from psycopg2.extras import RealDictCursor, execute_values
 from models import Ghost
 import os
 
+# Symptom tier -> JSONB column
+SYMPTOM_COLUMNS = {
+    'a': 'type_a_symptoms',
+    'b': 'type_b_symptoms',
+    'c': 'type_c_symptoms'
+}
+
 class Database:
     def __init__(self):
         self.connection = None
@@ -43,12 +52,43 @@ class Database:
                 self.connection.commit()
                 print("✅ Database tables created")
                 
+                self.create_indexes()
+                
                 # Seed initial data
                 self.seed_data()
         except Exception as e:
             print(f"❌ Database initialization failed: {e}")
             raise
 
+    def create_indexes(self):
+        """Create the indexes bulk upserts and symptom filters rely on"""
+        # Bulk imports upsert by name, so the service cannot run without this index
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS ghosts_name_key ON ghosts (name)")
+                self.connection.commit()
+        except psycopg2.errors.UniqueViolation:
+            self.connection.rollback()
+            with self.connection.cursor() as cursor:
+                cursor.execute("SELECT name FROM ghosts GROUP BY name HAVING COUNT(*) > 1 ORDER BY name")
+                duplicates = [row[0] for row in cursor.fetchall()]
+            self.connection.rollback()
+            raise Exception(f"Ghost names must be unique, rename or remove the duplicates first: {', '.join(duplicates)}")
+        
+        # Symptom containment filters (@>) on each tier; filters still work, slower, without them
+        try:
+            with self.connection.cursor() as cursor:
+                for column in SYMPTOM_COLUMNS.values():
+                    cursor.execute(f"""
+                        CREATE INDEX IF NOT EXISTS ghosts_{column}_idx
+                        ON ghosts USING GIN ({column} jsonb_path_ops)
+                    """)
+                self.connection.commit()
+                print("✅ Database indexes created")
+        except Exception as e:
+            self.connection.rollback()
+            print(f"❌ Creating symptom indexes failed: {e}")
+
     def seed_data(self):
         """Seed initial ghost data"""
         try:
@@ -151,6 +191,41 @@ class Database:
         except Exception as e:
             raise e
 
+    def find_ghosts(self, symptoms, tiers):
+        """Get ghosts showing every given symptom in one of the given tiers"""
+        try:
+            with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                # One containment test per symptom and tier, so each can use that tier's GIN index
+                conditions = []
+                params = []
+                for symptom in symptoms:
+                    conditions.append("(" + " OR ".join(
+                        f"{SYMPTOM_COLUMNS[tier]} @> %s::jsonb" for tier in tiers
+                    ) + ")")
+                    params.extend([json.dumps([symptom])] * len(tiers))
+                
+                cursor.execute(f"""
+                    SELECT id, name, type_a_symptoms, type_b_symptoms, type_c_symptoms,
+                           created_at, updated_at 
+                    FROM ghosts 
+                    WHERE {' AND '.join(conditions) or 'TRUE'}
+                    ORDER BY name
+                """, params)
+                
+                return [Ghost(
+                    id=ghost_data['id'],
+                    name=ghost_data['name'],
+                    type_a_symptoms=ghost_data['type_a_symptoms'],
+                    type_b_symptoms=ghost_data['type_b_symptoms'],
+                    type_c_symptoms=ghost_data['type_c_symptoms'],
+                    created_at=ghost_data['created_at'].isoformat() + "Z",
+                    updated_at=ghost_data['updated_at'].isoformat() + "Z"
+                ) for ghost_data in cursor.fetchall()]
+                
+        except Exception as e:
+            self.connection.rollback()
+            raise e
+
     def create_ghost(self, ghost: Ghost):
         """Create a new ghost"""
         try:
@@ -212,6 +287,41 @@ class Database:
             self.connection.rollback()
             raise e
 
+    def upsert_ghosts(self, ghosts):
+        """Insert or replace ghosts by name in one statement.
+
+        Returns (id, name, inserted) for every ghost that was written; ghosts
+        identical to the stored row are left untouched and not returned.
+        """
+        try:
+            with self.connection.cursor() as cursor:
+                rows = execute_values(cursor, """
+                    INSERT INTO ghosts (id, name, type_a_symptoms, type_b_symptoms, type_c_symptoms)
+                    VALUES %s
+                    ON CONFLICT (name) DO UPDATE SET
+                        type_a_symptoms = EXCLUDED.type_a_symptoms,
+                        type_b_symptoms = EXCLUDED.type_b_symptoms,
+                        type_c_symptoms = EXCLUDED.type_c_symptoms,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE (ghosts.type_a_symptoms, ghosts.type_b_symptoms, ghosts.type_c_symptoms)
+                        IS DISTINCT FROM
+                        (EXCLUDED.type_a_symptoms, EXCLUDED.type_b_symptoms, EXCLUDED.type_c_symptoms)
+                    RETURNING id, name, xmax = 0 AS inserted
+                """, [(
+                    ghost.id,
+                    ghost.name,
+                    json.dumps(ghost.type_a_symptoms),
+                    json.dumps(ghost.type_b_symptoms),
+                    json.dumps(ghost.type_c_symptoms)
+                ) for ghost in ghosts], template="(%s, %s, %s::jsonb, %s::jsonb, %s::jsonb)",
+                    page_size=max(len(ghosts), 1), fetch=True)
+                self.connection.commit()
+                return rows
+                
+        except Exception as e:
+            self.connection.rollback()
+            raise e
+
     def close(self):
         """Close database connection"""
         if self.connection:
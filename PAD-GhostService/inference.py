@@ -0,0 +1,55 @@
+import os
+import numpy as np
+
+PROBABILITY_EPSILON = 1e-6
+
+class GhostModel:
+    """Naive Bayes model of which symptoms a player observes for each ghost.
+
+    A ghost shows each of its symptoms with a probability set by the symptom's
+    tier (A most reliably), and any other symptom is seen with a small false
+    positive rate. Observed and ruled-out symptoms are treated as independent,
+    so the log-likelihoods of a batch of journals are one matrix multiply of
+    their indicator vectors with the stacked log P and log (1 - P) matrices.
+    """
+
+    def __init__(self, symptoms, ghosts):
+        tier_weights = [float(w) for w in os.getenv('GHOST_TIER_WEIGHTS', '0.9,0.6,0.3').split(',')]
+        false_positive = float(os.getenv('GHOST_FALSE_POSITIVE_RATE', '0.02'))
+
+        self.symptoms = symptoms
+        n_symptoms = len(symptoms.symptom_ids)
+        # likelihood[s, g] = P(symptom s is observed | ghost g)
+        likelihood = np.full((n_symptoms, len(ghosts)), false_positive)
+        for g, ghost in enumerate(ghosts):
+            tiers = [ghost.type_a_symptoms, ghost.type_b_symptoms, ghost.type_c_symptoms]
+            for tier, weight in zip(tiers, tier_weights):
+                for symptom in tier:
+                    s = symptoms.symptom_ids[symptom]
+                    likelihood[s, g] = max(likelihood[s, g], weight)
+        # A probability of exactly 0 or 1 would put -inf in the weights and 0 * -inf = NaN in the scores
+        likelihood = np.clip(likelihood, PROBABILITY_EPSILON, 1 - PROBABILITY_EPSILON)
+        self.weights = np.vstack([np.log(likelihood), np.log1p(-likelihood)])
+
+    def encode(self, journals) -> np.ndarray:
+        """Indicator matrix [observed | ruled out] of (symptoms, excluded) pairs; unknown symptoms are skipped"""
+        n_symptoms = len(self.symptoms.symptom_ids)
+        rows, cols = [], []
+        for j, (observed, excluded) in enumerate(journals):
+            for offset, names in [(0, observed), (n_symptoms, excluded)]:
+                for symptom in names:
+                    s = self.symptoms.symptom_ids.get(symptom)
+                    if s is not None:
+                        rows.append(j)
+                        cols.append(offset + s)
+        indicators = np.zeros((len(journals), 2 * n_symptoms))
+        indicators[rows, cols] = 1.0
+        return indicators
+
+    def posteriors(self, indicators: np.ndarray) -> np.ndarray:
+        """P(ghost | journal) for each row of indicators, under a uniform prior"""
+        log_likelihood = indicators @ self.weights
+        log_likelihood -= log_likelihood.max(axis=1, keepdims=True)
+        probabilities = np.exp(log_likelihood)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        return probabilities
@@ -47,6 +47,27 @@ class UpdateGhostRequest:
     type_b_symptoms: Optional[List[str]] = None
     type_c_symptoms: Optional[List[str]] = None
 
+@dataclass
+class BulkGhostsRequest:
+    ghosts: List[Dict[str, Any]]
+
+@dataclass
+class IdentifyGhostRequest:
+    symptoms: List[str] = None
+    excluded: List[str] = None
+    observations: Optional[List[Dict[str, Any]]] = None
+    limit: Optional[int] = None
+    
+    def __post_init__(self):
+        if self.symptoms is None:
+            self.symptoms = []
+        if self.excluded is None:
+            self.excluded = []
+
+@dataclass
+class InferGhostRequest:
+    journals: List[Dict[str, Any]]
+
 @dataclass
 class GhostsResponse:
     ghosts: List[Dict[str, Any]]
\ No newline at end of file
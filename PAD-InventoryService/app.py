@@ -132,6 +132,146 @@ def remove_item(user_id, item_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/inventory/<user_id>/batch', methods=['POST'])
+def batch_items(user_id):
+    """Apply a list of add/update/remove operations atomically"""
+    try:
+        data = request.get_json()
+        operations = data.get('operations')
+        if not isinstance(operations, list) or not operations:
+            return jsonify({'error': 'operations must be a non-empty list'}), 400
+        
+        # Validate every operation before touching the database
+        adds, updates, removes = [], [], []
+        item_ids = set()
+        for operation in operations:
+            if not isinstance(operation, dict) or operation.get('op') not in ('add', 'update', 'remove'):
+                return jsonify({'error': 'Each operation needs op: add, update or remove'}), 400
+            if 'itemId' not in operation:
+                return jsonify({'error': 'Missing required field: itemId'}), 400
+            if operation['itemId'] in item_ids:
+                return jsonify({'error': f"Item {operation['itemId']} appears in more than one operation"}), 400
+            item_ids.add(operation['itemId'])
+            
+            if operation['op'] == 'add':
+                for field in ['name', 'durability']:
+                    if field not in operation:
+                        return jsonify({'error': f'Missing required field: {field}'}), 400
+                adds.append({
+                    'item_id': operation['itemId'],
+                    'name': operation['name'],
+                    'durability': operation['durability'],
+                    'max_durability': operation.get('maxDurability', operation['durability'])
+                })
+            elif operation['op'] == 'update':
+                if 'durability' not in operation and 'equipped' not in operation:
+                    return jsonify({'error': 'No fields to update. Provide durability or equipped'}), 400
+                updates.append({
+                    'item_id': operation['itemId'],
+                    'durability': operation.get('durability'),
+                    'equipped': operation.get('equipped')
+                })
+            else:
+                removes.append(operation['itemId'])
+        
+        added, updated, removed = db.apply_batch(user_id, adds, updates, removes)
+        applied = len(added) == len(adds) and len(updated) == len(updates) and len(removed) == len(removes)
+        
+        results = []
+        for operation in operations:
+            item_id = operation['itemId']
+            result = {'op': operation['op'], 'itemId': item_id}
+            if operation['op'] == 'add':
+                if item_id in added:
+                    result.update(status='added', inventoryId=added[item_id])
+                else:
+                    result.update(status='failed', error='Item already exists in inventory')
+            elif operation['op'] == 'update':
+                if item_id in updated:
+                    durability, equipped = updated[item_id]
+                    result.update(status='updated', durability=durability, equipped=equipped)
+                else:
+                    result.update(status='failed', error='Item not found in inventory')
+            else:
+                if item_id in removed:
+                    result.update(status='removed')
+                else:
+                    result.update(status='failed', error='Item not found in inventory')
+            # Operations that would have applied were rolled back with the rest of the batch
+            if not applied and result['status'] != 'failed':
+                result['status'] = 'rolled_back'
+            results.append(result)
+        
+        response = BatchResponse(
+            user_id=user_id,
+            applied=applied,
+            results=results
+        )
+        
+        return jsonify(asdict(response)), 200 if applied else 409
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def valid_wear_amount(amount) -> bool:
+    return isinstance(amount, int) and not isinstance(amount, bool) and amount > 0
+
+@app.route('/inventory/wear', methods=['POST'])
+def wear_items():
+    """Wear down equipped items of many players, or specific items, in one statement"""
+    try:
+        data = request.get_json()
+        
+        if ('userIds' in data) == ('items' in data):
+            return jsonify({'error': 'Provide either userIds with amount, or items'}), 400
+        
+        if 'userIds' in data:
+            # All equipped items of these players, by the same amount
+            user_ids = data['userIds']
+            if not isinstance(user_ids, list) or not all(isinstance(u, str) for u in user_ids):
+                return jsonify({'error': 'userIds must be a list of strings'}), 400
+            if not valid_wear_amount(data.get('amount')):
+                return jsonify({'error': 'amount must be a positive integer'}), 400
+            rows = db.wear_equipped_items(user_ids, data['amount']) if user_ids else []
+        else:
+            # Specific items, each by its own amount
+            items = data['items']
+            if not isinstance(items, list) or not all(isinstance(i, dict) for i in items):
+                return jsonify({'error': 'items must be a list of objects'}), 400
+            wear = []
+            keys = set()
+            for item in items:
+                for field in ['userId', 'itemId', 'amount']:
+                    if field not in item:
+                        return jsonify({'error': f'Missing required field: {field}'}), 400
+                if not valid_wear_amount(item['amount']):
+                    return jsonify({'error': 'amount must be a positive integer'}), 400
+                key = (item['userId'], item['itemId'])
+                if key in keys:
+                    return jsonify({'error': f"Item {item['itemId']} of {item['userId']} is listed more than once"}), 400
+                keys.add(key)
+                wear.append((item['userId'], item['itemId'], item['amount']))
+            rows = db.wear_items(wear) if wear else []
+        
+        response = WearResponse(
+            worn=[{
+                'userId': user_id,
+                'itemId': item_id,
+                'durability': durability
+            } for user_id, item_id, name, durability in rows],
+            # Only items still above 0 are worn, so these were used up by this request
+            consumed=[{
+                'userId': user_id,
+                'itemId': item_id,
+                'name': name
+            } for user_id, item_id, name, durability in rows if durability == 0]
+        )
+        
+        return jsonify(asdict(response)), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
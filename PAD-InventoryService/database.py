@@ -1,6 +1,7 @@
 import psycopg2
 import json
-from psycopg2.extras import RealDictCursor
+import uuid
+from psycopg2.extras import RealDictCursor, execute_values
 from models import InventoryItem
 import os
 from datetime import datetime
@@ -46,6 +47,7 @@ class Database:
                     CREATE INDEX IF NOT EXISTS idx_inventory_user_id ON inventory (user_id);
                     CREATE INDEX IF NOT EXISTS idx_inventory_item_id ON inventory (item_id);
                     CREATE UNIQUE INDEX IF NOT EXISTS idx_inventory_user_item ON inventory (user_id, item_id);
+                    CREATE INDEX IF NOT EXISTS idx_inventory_equipped_user ON inventory (user_id) WHERE equipped;
                 """)
                 self.connection.commit()
                 print("✅ Database tables created")
@@ -242,6 +244,117 @@ class Database:
             self.connection.rollback()
             raise e
 
+    def apply_batch(self, user_id: str, adds: list, updates: list, removes: list):
+        """Apply add, update and remove operations on distinct items in one transaction.
+
+        Each kind is a single set-based statement. The batch is committed only
+        if every operation applied (no item added twice, none missing for update
+        or remove), and rolled back otherwise. Returns ({item_id: inventory_id}
+        added, {item_id: (durability, equipped)} updated, set of item_ids removed)
+        as seen inside the transaction.
+        """
+        try:
+            with self.connection.cursor() as cursor:
+                removed = set()
+                if removes:
+                    cursor.execute("""
+                        DELETE FROM inventory
+                        WHERE user_id = %s AND item_id = ANY(%s)
+                        RETURNING item_id
+                    """, (user_id, removes))
+                    removed = {row[0] for row in cursor.fetchall()}
+                
+                updated = {}
+                if updates:
+                    rows = execute_values(cursor, """
+                        UPDATE inventory SET
+                            durability = COALESCE(changes.durability, inventory.durability),
+                            equipped = COALESCE(changes.equipped, inventory.equipped),
+                            updated_at = CURRENT_TIMESTAMP
+                        FROM (VALUES %s) AS changes (user_id, item_id, durability, equipped)
+                        WHERE inventory.user_id = changes.user_id AND inventory.item_id = changes.item_id
+                        RETURNING inventory.item_id, inventory.durability, inventory.equipped
+                    """, [
+                        (user_id, item['item_id'], item.get('durability'), item.get('equipped'))
+                        for item in updates
+                    ], template="(%s, %s, %s::integer, %s::boolean)", page_size=len(updates), fetch=True)
+                    updated = {item_id: (durability, equipped) for item_id, durability, equipped in rows}
+                
+                added = {}
+                if adds:
+                    rows = execute_values(cursor, """
+                        INSERT INTO inventory (id, user_id, item_id, name, durability, max_durability, equipped)
+                        VALUES %s
+                        ON CONFLICT (user_id, item_id) DO NOTHING
+                        RETURNING item_id, id
+                    """, [(
+                        self.generate_uuid(),
+                        user_id,
+                        item['item_id'],
+                        item['name'],
+                        item['durability'],
+                        item.get('max_durability', item['durability']),
+                        False  # Default to not equipped
+                    ) for item in adds], page_size=len(adds), fetch=True)
+                    added = dict(rows)
+                
+                if len(added) == len(adds) and len(updated) == len(updates) and len(removed) == len(removes):
+                    self.connection.commit()
+                else:
+                    self.connection.rollback()
+                return added, updated, removed
+                
+        except Exception as e:
+            self.connection.rollback()
+            raise e
+
+    def wear_equipped_items(self, user_ids: list, amount: int):
+        """Decrease the durability of every equipped item of the given users, down to 0.
+
+        Items already at 0 are left alone. Returns (user_id, item_id, name, durability)
+        for each worn item.
+        """
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE inventory SET
+                        durability = GREATEST(durability - %s, 0),
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE user_id = ANY(%s) AND equipped AND durability > 0
+                    RETURNING user_id, item_id, name, durability
+                """, (amount, user_ids))
+                rows = cursor.fetchall()
+                self.connection.commit()
+                return rows
+                
+        except Exception as e:
+            self.connection.rollback()
+            raise e
+
+    def wear_items(self, wear: list):
+        """Decrease the durability of specific items by their own amounts, down to 0.
+
+        wear holds distinct (user_id, item_id, amount) entries. Items already at 0
+        are left alone. Returns (user_id, item_id, name, durability) for each worn item.
+        """
+        try:
+            with self.connection.cursor() as cursor:
+                rows = execute_values(cursor, """
+                    UPDATE inventory SET
+                        durability = GREATEST(inventory.durability - wear.amount, 0),
+                        updated_at = CURRENT_TIMESTAMP
+                    FROM (VALUES %s) AS wear (user_id, item_id, amount)
+                    WHERE inventory.user_id = wear.user_id AND inventory.item_id = wear.item_id
+                        AND inventory.durability > 0
+                    RETURNING inventory.user_id, inventory.item_id, inventory.name, inventory.durability
+                """, wear, template="(%s, %s, %s::integer)", page_size=max(len(wear), 1), fetch=True)
+                self.connection.commit()
+                return rows
+                
+        except Exception as e:
+            self.connection.rollback()
+            raise e
+
     def get_inventory_item(self, user_id: str, item_id: str):
         """Get specific item from user's inventory"""
         try:
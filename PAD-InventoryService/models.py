@@ -53,4 +53,15 @@ class UpdateItemResponse:
 @dataclass
 class RemoveItemResponse:
     message: str
-    removed_item_id: str
\ No newline at end of file
+    removed_item_id: str
+
+@dataclass
+class BatchResponse:
+    user_id: str
+    applied: bool
+    results: List[Dict[str, Any]]
+
+@dataclass
+class WearResponse:
+    worn: List[Dict[str, Any]]
+    consumed: List[Dict[str, Any]]
\ No newline at end of file
@@ -1,14 +1,26 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import uuid
+import os
 from database import Database
 from models import *
+from sanity_engine import SanityEngine
+from membership_index import LobbyMembershipIndex
 
 app = Flask(__name__)
 CORS(app)
 db = Database()
+sanity_engine = SanityEngine(Database(initialize=False))
+memberships = LobbyMembershipIndex(db)
 
 # Helper functions
+def load_lobby(lobby_id: str) -> Lobby:
+    """Load lobby with the sanity engine's live player state applied"""
+    lobby = db.get_lobby(lobby_id)
+    if lobby:
+        sanity_engine.apply_to(lobby)
+    return lobby
+
 def find_player_in_lobby(lobby: Lobby, user_id: str) -> Player:
     """Find player in lobby by user_id"""
     for player in lobby.players:
@@ -39,6 +51,7 @@ def create_lobby():
         )
         
         db.create_lobby(lobby)
+        memberships.add(lobby.host_user_id, lobby.id)
         
         # Return response
         response = {
@@ -61,7 +74,7 @@ def join_lobby(lobby_id):
         data = request.get_json()
         req = JoinLobbyRequest(**data)
         
-        lobby = db.get_lobby(lobby_id)
+        lobby = load_lobby(lobby_id)
         if not lobby:
             return jsonify({'error': 'Lobby not found'}), 404
         
@@ -86,6 +99,8 @@ def join_lobby(lobby_id):
             lobby.status = 'active'
         
         db.update_lobby(lobby)
+        sanity_engine.sync_lobby(lobby)
+        memberships.add(req.user_id, lobby.id)
         
         response = {
             'id': lobby.id,
@@ -104,7 +119,7 @@ def leave_lobby(lobby_id):
         data = request.get_json()
         req = LeaveLobbyRequest(**data)
         
-        lobby = db.get_lobby(lobby_id)
+        lobby = load_lobby(lobby_id)
         if not lobby:
             return jsonify({'error': 'Lobby not found'}), 404
         
@@ -126,6 +141,8 @@ def leave_lobby(lobby_id):
             lobby.host_user_id = lobby.players[0].user_id
         
         db.update_lobby(lobby)
+        sanity_engine.sync_lobby(lobby)
+        memberships.remove(req.user_id, lobby.id)
         
         return jsonify({'left': True}), 200
         
@@ -139,7 +156,7 @@ def update_player(lobby_id, user_id):
         data = request.get_json()
         req = UpdatePlayerRequest(**data)
         
-        lobby = db.get_lobby(lobby_id)
+        lobby = load_lobby(lobby_id)
         if not lobby:
             return jsonify({'error': 'Lobby not found'}), 404
         
@@ -154,6 +171,7 @@ def update_player(lobby_id, user_id):
             player.dead = req.dead
         
         db.update_lobby(lobby)
+        sanity_engine.set_player(lobby.id, user_id, player.sanity, player.dead)
         
         response = {
             'userId': player.user_id,
@@ -173,7 +191,7 @@ def bring_item(lobby_id):
         data = request.get_json()
         req = BringItemRequest(**data)
         
-        lobby = db.get_lobby(lobby_id)
+        lobby = load_lobby(lobby_id)
         if not lobby:
             return jsonify({'error': 'Lobby not found'}), 404
         
@@ -196,7 +214,7 @@ def bring_item(lobby_id):
 def get_lobby(lobby_id):
     """Get current lobby state"""
     try:
-        lobby = db.get_lobby(lobby_id)
+        lobby = load_lobby(lobby_id)
         if not lobby:
             return jsonify({'error': 'Lobby not found'}), 404
         
@@ -217,6 +235,34 @@ def get_lobby(lobby_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/users/<user_id>/lobbies', methods=['GET'])
+def get_user_lobbies(user_id):
+    """Get the lobbies a user is currently in (e.g. to reconnect after a crash)"""
+    try:
+        lobby_ids = memberships.get(user_id)
+        lobbies = db.get_lobbies_by_ids(lobby_ids) if lobby_ids else []
+        
+        response = {
+            'userId': user_id,
+            'lobbies': [{
+                'id': lobby.id,
+                'difficulty': lobby.difficulty,
+                'mapId': lobby.map_id,
+                'hostUserId': lobby.host_user_id,
+                'players': [{
+                    'userId': p.user_id,
+                    'sanity': p.sanity,
+                    'dead': p.dead
+                } for p in sanity_engine.apply_to(lobby).players],
+                'status': lobby.status
+            } for lobby in lobbies]
+        }
+        
+        return jsonify(response), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
@@ -236,4 +282,8 @@ def health():
         }), 500
 
 if __name__ == '__main__':
+    # The debug reloader runs this module in a watcher process as well,
+    # only the serving process should drive the sanity engine
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        sanity_engine.start()
     app.run(host='0.0.0.0', port=3005, debug=True)
\ No newline at end of file
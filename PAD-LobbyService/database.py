@@ -1,14 +1,16 @@
 import psycopg2
 import json
-from psycopg2.extras import RealDictCursor
+from dataclasses import asdict
+from psycopg2.extras import RealDictCursor, execute_values
 from models import Lobby, Player
 import os
 
 class Database:
-    def __init__(self):
+    def __init__(self, initialize: bool = True):
         self.connection = None
         self.connect()
-        self.init_db()
+        if initialize:
+            self.init_db()
 
     def connect(self):
         """Connect to PostgreSQL database"""
@@ -40,6 +42,8 @@ class Database:
                         status VARCHAR(50) DEFAULT 'open',
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     );
+
+                    CREATE INDEX IF NOT EXISTS idx_lobbies_players ON lobbies USING GIN (players jsonb_path_ops);
                 """)
                 self.connection.commit()
                 print("✅ Database tables created")
@@ -79,23 +83,60 @@ class Database:
                 if not result:
                     return None
                 
-                # Convert JSON players to Player objects
-                players_data = result['players']
-                players = [Player(**player_data) for player_data in players_data]
-                
-                return Lobby(
-                    id=result['id'],
-                    host_user_id=result['host_user_id'],
-                    map_id=result['map_id'],
-                    difficulty=result['difficulty'],
-                    max_players=result['max_players'],
-                    players=players,
-                    status=result['status'],
-                    created_at=result['created_at'].isoformat() + "Z"
+                return self._row_to_lobby(result)
+        except Exception as e:
+            raise e
+
+    def get_lobbies_by_status(self, status: str):
+        """Get all lobbies with the given status"""
+        try:
+            with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("SELECT * FROM lobbies WHERE status = %s", (status,))
+                return [self._row_to_lobby(result) for result in cursor.fetchall()]
+        except Exception as e:
+            raise e
+
+    def get_lobbies_by_ids(self, lobby_ids):
+        """Get lobbies by primary key"""
+        try:
+            with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    "SELECT * FROM lobbies WHERE id = ANY(%s) ORDER BY created_at DESC",
+                    (list(lobby_ids),)
                 )
+                return [self._row_to_lobby(result) for result in cursor.fetchall()]
         except Exception as e:
             raise e
 
+    def get_lobby_ids_for_user(self, user_id: str):
+        """Get ids of the non-closed lobbies a user is a player in (uses the players GIN index)"""
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT id FROM lobbies WHERE players @> %s::jsonb AND status != 'closed'",
+                    (json.dumps([{'user_id': user_id}]),)
+                )
+                return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            raise e
+
+    def _row_to_lobby(self, result) -> Lobby:
+        """Convert a lobbies row to a Lobby object"""
+        # Convert JSON players to Player objects
+        players_data = result['players']
+        players = [Player(**player_data) for player_data in players_data]
+        
+        return Lobby(
+            id=result['id'],
+            host_user_id=result['host_user_id'],
+            map_id=result['map_id'],
+            difficulty=result['difficulty'],
+            max_players=result['max_players'],
+            players=players,
+            status=result['status'],
+            created_at=result['created_at'].isoformat() + "Z"
+        )
+
     def update_lobby(self, lobby: Lobby):
         """Update lobby data"""
         try:
@@ -114,6 +155,34 @@ class Database:
             self.connection.rollback()
             raise e
 
+    def update_player_states(self, states: dict):
+        """Merge sanity/dead state into the players of many lobbies in one statement
+
+        states maps lobby_id -> {user_id: {'sanity': ..., 'dead': ...}}. Only the
+        given keys are merged into each player object, so items and membership
+        changes written concurrently are preserved.
+        """
+        try:
+            with self.connection.cursor() as cursor:
+                execute_values(cursor, """
+                    UPDATE lobbies l
+                    SET players = COALESCE((
+                        SELECT jsonb_agg(
+                            CASE WHEN v.state ? (p.player->>'user_id')
+                                 THEN p.player || (v.state -> (p.player->>'user_id'))
+                                 ELSE p.player END
+                            ORDER BY p.ord)
+                        FROM jsonb_array_elements(l.players) WITH ORDINALITY AS p(player, ord)
+                    ), '[]'::jsonb)
+                    FROM (VALUES %s) AS v(id, state)
+                    WHERE l.id = v.id
+                """, [(lobby_id, json.dumps(users)) for lobby_id, users in states.items()],
+                    template="(%s, %s::jsonb)", page_size=1000)
+                self.connection.commit()
+        except Exception as e:
+            self.connection.rollback()
+            raise e
+
     def get_all_lobbies(self):
         """Get all lobbies (for debugging)"""
         try:
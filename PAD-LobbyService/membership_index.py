@@ -0,0 +1,46 @@
+import threading
+
+class LobbyMembershipIndex:
+    """In-memory reverse index from user_id to the ids of the lobbies they are in.
+
+    Entries are filled lazily from the players GIN index the first time a user
+    is looked up, and from then on kept current by the lobby write paths. Users
+    that were never looked up are not tracked, so memory follows active users
+    rather than the size of the lobbies table.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.lock = threading.Lock()
+        self.lobbies_by_user = {}  # user_id -> set of lobby ids
+        self.writes = 0
+
+    def get(self, user_id: str) -> set:
+        """Get the ids of the lobbies the user is currently in"""
+        with self.lock:
+            lobby_ids = self.lobbies_by_user.get(user_id)
+            if lobby_ids is not None:
+                return set(lobby_ids)
+            writes = self.writes
+
+        lobby_ids = set(self.db.get_lobby_ids_for_user(user_id))
+        with self.lock:
+            # Only cache the result if no membership changed while querying,
+            # otherwise the next lookup simply queries again
+            if self.writes == writes:
+                self.lobbies_by_user[user_id] = set(lobby_ids)
+        return lobby_ids
+
+    def add(self, user_id: str, lobby_id: str):
+        with self.lock:
+            self.writes += 1
+            lobby_ids = self.lobbies_by_user.get(user_id)
+            if lobby_ids is not None:
+                lobby_ids.add(lobby_id)
+
+    def remove(self, user_id: str, lobby_id: str):
+        with self.lock:
+            self.writes += 1
+            lobby_ids = self.lobbies_by_user.get(user_id)
+            if lobby_ids is not None:
+                lobby_ids.discard(lobby_id)
@@ -0,0 +1,190 @@
+import threading
+import time
+import os
+import numpy as np
+from models import Lobby
+
+# Sanity drained per second of hunt, by lobby difficulty
+DRAIN_RATES = {
+    'amateur': 0.08,
+    'intermediate': 0.12,
+    'professional': 0.16,
+    'nightmare': 0.20,
+    'insanity': 0.24
+}
+DEFAULT_DRAIN_RATE = DRAIN_RATES['intermediate']
+
+class SanityEngine:
+    """Server-side sanity drain for every player in every active lobby.
+
+    Player state lives in flat NumPy arrays indexed by slot, so one tick is a
+    handful of vectorized operations regardless of how many lobbies are running.
+    Changed slots are marked dirty and persisted in coalesced batches.
+    """
+
+    def __init__(self, db, capacity: int = 1024):
+        self.db = db
+        self.tick_interval = float(os.getenv('SANITY_TICK_INTERVAL', '1.0'))
+        self.flush_interval = float(os.getenv('SANITY_FLUSH_INTERVAL', '5.0'))
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = False
+
+        self.sanity = np.zeros(capacity, dtype=np.float64)
+        self.rate = np.zeros(capacity, dtype=np.float64)
+        self.dead = np.zeros(capacity, dtype=bool)
+        self.in_use = np.zeros(capacity, dtype=bool)
+        self.dirty = np.zeros(capacity, dtype=bool)
+        self.slot_lobby = [None] * capacity
+        self.slot_user = [None] * capacity
+        self.free_slots = list(range(capacity - 1, -1, -1))
+
+        self.slots = {}  # (lobby_id, user_id) -> slot
+        self.lobby_slots = {}  # lobby_id -> set of slots
+
+    def _grow(self):
+        """Double the capacity of the slot arrays"""
+        old = len(self.sanity)
+        new = old * 2
+        for name in ('sanity', 'rate', 'dead', 'in_use', 'dirty'):
+            arr = getattr(self, name)
+            grown = np.zeros(new, dtype=arr.dtype)
+            grown[:old] = arr
+            setattr(self, name, grown)
+        self.slot_lobby.extend([None] * old)
+        self.slot_user.extend([None] * old)
+        self.free_slots.extend(range(new - 1, old - 1, -1))
+
+    def _add_player(self, lobby_id: str, user_id: str, sanity: float, dead: bool, rate: float):
+        if not self.free_slots:
+            self._grow()
+        slot = self.free_slots.pop()
+        self.sanity[slot] = sanity
+        self.dead[slot] = dead
+        self.rate[slot] = rate
+        self.in_use[slot] = True
+        self.dirty[slot] = False
+        self.slot_lobby[slot] = lobby_id
+        self.slot_user[slot] = user_id
+        self.slots[(lobby_id, user_id)] = slot
+        self.lobby_slots.setdefault(lobby_id, set()).add(slot)
+
+    def _remove_slot(self, slot: int):
+        key = (self.slot_lobby[slot], self.slot_user[slot])
+        del self.slots[key]
+        lobby_slots = self.lobby_slots[key[0]]
+        lobby_slots.discard(slot)
+        if not lobby_slots:
+            del self.lobby_slots[key[0]]
+        self.in_use[slot] = False
+        self.dirty[slot] = False
+        self.slot_lobby[slot] = None
+        self.slot_user[slot] = None
+        self.free_slots.append(slot)
+
+    def sync_lobby(self, lobby: Lobby):
+        """Track the lobby's current players while it is active, drop it otherwise"""
+        with self.lock:
+            tracked = self.lobby_slots.get(lobby.id, set())
+            if lobby.status != 'active':
+                for slot in list(tracked):
+                    self._remove_slot(slot)
+                return
+
+            rate = DRAIN_RATES.get(lobby.difficulty.lower(), DEFAULT_DRAIN_RATE)
+            user_ids = {p.user_id for p in lobby.players}
+            for slot in list(tracked):
+                if self.slot_user[slot] not in user_ids:
+                    self._remove_slot(slot)
+            for player in lobby.players:
+                if (lobby.id, player.user_id) not in self.slots:
+                    self._add_player(lobby.id, player.user_id, player.sanity, player.dead, rate)
+
+    def set_player(self, lobby_id: str, user_id: str, sanity: float = None, dead: bool = None):
+        """Override a tracked player's state (e.g. from an explicit game event)"""
+        with self.lock:
+            slot = self.slots.get((lobby_id, user_id))
+            if slot is None:
+                return
+            if sanity is not None:
+                self.sanity[slot] = sanity
+            if dead is not None:
+                self.dead[slot] = dead
+
+    def apply_to(self, lobby: Lobby) -> Lobby:
+        """Overlay the engine's up-to-date sanity and death state onto a loaded lobby"""
+        with self.lock:
+            for player in lobby.players:
+                slot = self.slots.get((lobby.id, player.user_id))
+                if slot is not None:
+                    player.sanity = float(self.sanity[slot])
+                    player.dead = bool(self.dead[slot])
+        return lobby
+
+    def tick(self, dt: float):
+        """Advance sanity for all tracked players by dt seconds"""
+        with self.lock:
+            live = self.in_use & ~self.dead
+            np.subtract(self.sanity, self.rate * dt, out=self.sanity, where=live)
+            np.clip(self.sanity, 0.0, 100.0, out=self.sanity)
+            self.dead |= live & (self.sanity <= 0.0)
+            self.dirty |= live
+
+    def flush(self):
+        """Persist dirty player state, one batched statement for all lobbies"""
+        with self.lock:
+            slots = np.flatnonzero(self.dirty)
+            if len(slots) == 0:
+                return 0
+            states = {}
+            for slot, sanity, dead in zip(slots.tolist(), self.sanity[slots].tolist(), self.dead[slots].tolist()):
+                states.setdefault(self.slot_lobby[slot], {})[self.slot_user[slot]] = {
+                    'sanity': sanity,
+                    'dead': dead
+                }
+            self.dirty[slots] = False
+
+        try:
+            self.db.update_player_states(states)
+        except Exception as e:
+            # Mark the batch dirty again so the next flush retries it
+            with self.lock:
+                for lobby_id, users in states.items():
+                    for user_id in users:
+                        slot = self.slots.get((lobby_id, user_id))
+                        if slot is not None:
+                            self.dirty[slot] = True
+            print(f"❌ Sanity flush failed: {e}")
+            return 0
+        return len(slots)
+
+    def load(self):
+        """Start tracking every lobby that is currently active"""
+        for lobby in self.db.get_lobbies_by_status('active'):
+            self.sync_lobby(lobby)
+
+    def run(self):
+        last_tick = time.monotonic()
+        last_flush = last_tick
+        while self.running:
+            time.sleep(self.tick_interval)
+            now = time.monotonic()
+            self.tick(now - last_tick)
+            last_tick = now
+            if now - last_flush >= self.flush_interval:
+                self.flush()
+                last_flush = now
+        self.flush()
+
+    def start(self):
+        """Load active lobbies and start the background tick loop"""
+        self.load()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='sanity-engine', daemon=True)
+        self.thread.start()
+        print(f"✅ Sanity engine started ({len(self.slots)} players)")
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
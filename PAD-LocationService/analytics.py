@@ -0,0 +1,112 @@
+import numpy as np
+
+# Bits of the per-sample flags column (the client wire format has its own, codec.WIRE_FLAG_*)
+FLAG_HIDING = 1
+FLAG_SPEAKING = 2
+
+# Row layout of `COPY (SELECT user_code::int4, room_code::int4, epoch::float8, flags::int2) TO STDOUT (FORMAT binary)`:
+# a field count followed by (length, value) for every field, all big-endian
+COPY_ROW_DTYPE = np.dtype([
+    ('fields', '>i2'),
+    ('user_len', '>i4'), ('user', '>i4'),
+    ('room_len', '>i4'), ('room', '>i4'),
+    ('ts_len', '>i4'), ('ts', '>f8'),
+    ('flags_len', '>i4'), ('flags', '>i2')
+])
+COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+
+def parse_binary_copy(data: bytes) -> np.ndarray:
+    """Turn the output of a binary COPY with the COPY_ROW_DTYPE layout into a record array"""
+    if not data:
+        return np.zeros(0, dtype=COPY_ROW_DTYPE)
+    if not data.startswith(COPY_SIGNATURE):
+        raise ValueError('Not a binary COPY stream')
+    header_ext = int.from_bytes(data[15:19], 'big')
+    start = 19 + header_ext
+    end = len(data) - 2  # trailer: field count of -1
+    return np.frombuffer(data, dtype=COPY_ROW_DTYPE, count=(end - start) // COPY_ROW_DTYPE.itemsize, offset=start)
+
+def compute_lobby_analytics(users, rooms, user_codes, room_codes, ts, flags,
+                            max_gap: float, resolution: float = 1.0, max_bins: int = None) -> dict:
+    """Compute per-player isolation/dwell times and a co-presence matrix for one lobby.
+
+    Each sample is taken to hold until the user's next sample, or for nothing
+    if that is more than max_gap seconds later (the player dropped out).
+    Co-presence, and time alone (no one else in the room), are measured on a
+    grid of `resolution` seconds; ValueError is raised if that grid would have
+    more than max_bins time bins.
+    """
+    n_users = len(users)
+    n_rooms = len(rooms)
+    user_codes = np.asarray(user_codes, dtype=np.int64)
+    room_codes = np.asarray(room_codes, dtype=np.int64)
+    ts = np.asarray(ts, dtype=np.float64)
+    flags = np.asarray(flags, dtype=np.int64)
+
+    if len(ts) == 0:
+        return {
+            'sample_count': 0,
+            'players': [],
+            'copresence': {'users': [], 'seconds': []}
+        }
+
+    order = np.lexsort((ts, user_codes))
+    user_codes = user_codes[order]
+    room_codes = room_codes[order]
+    ts = ts[order]
+    flags = flags[order]
+
+    # How long each sample's state lasted
+    dt = np.zeros(len(ts))
+    dt[:-1] = ts[1:] - ts[:-1]
+    dt[:-1][user_codes[1:] != user_codes[:-1]] = 0.0
+    dt[dt > max_gap] = 0.0
+
+    tracked = np.bincount(user_codes, weights=dt, minlength=n_users)
+    hiding = np.bincount(user_codes, weights=dt * ((flags & FLAG_HIDING) != 0), minlength=n_users)
+    speaking = np.bincount(user_codes, weights=dt * ((flags & FLAG_SPEAKING) != 0), minlength=n_users)
+    dwell = np.bincount(user_codes * n_rooms + room_codes, weights=dt,
+                        minlength=n_users * n_rooms).reshape(n_users, n_rooms)
+
+    # Rasterize each sample's [ts, ts + dt) onto the time grid: room per (bin, user), -1 when absent
+    t0 = ts.min()
+    if max_bins is not None and ((ts + dt).max() - t0) / resolution >= max_bins:
+        raise ValueError(f'resolution {resolution} is too fine for this time range, '
+                         f'the grid would exceed {max_bins} bins')
+    start_bins = np.floor((ts - t0) / resolution).astype(np.int64)
+    end_bins = np.floor((ts + dt - t0) / resolution).astype(np.int64)
+    lengths = end_bins - start_bins
+    n_bins = int(end_bins.max()) + 1
+    covered = int(lengths.sum())
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    bins = np.repeat(start_bins, lengths) + (np.arange(covered) - offsets)
+    grid = np.full((n_bins, n_users), -1, dtype=np.int32)
+    grid[bins, np.repeat(user_codes, lengths)] = np.repeat(room_codes, lengths)
+
+    copresence = np.zeros((n_users, n_users))
+    alone = np.zeros(n_users)
+    for room in np.unique(room_codes):
+        present = (grid == room).astype(np.float32)
+        copresence += present.T @ present
+        alone += present[present.sum(axis=1) == 1].sum(axis=0)
+    copresence *= resolution
+    alone *= resolution
+
+    return {
+        'sample_count': int(len(ts)),
+        'players': [{
+            'user_id': users[u],
+            'tracked_seconds': round(float(tracked[u]), 3),
+            'alone_seconds': round(float(alone[u]), 3),
+            'hiding_seconds': round(float(hiding[u]), 3),
+            'speaking_seconds': round(float(speaking[u]), 3),
+            'dwell_seconds': {
+                rooms[r]: round(float(dwell[u, r]), 3)
+                for r in np.flatnonzero(dwell[u])
+            }
+        } for u in range(n_users)],
+        'copresence': {
+            'users': list(users),
+            'seconds': np.round(copresence, 3).tolist()
+        }
+    }
@@ -1,12 +1,94 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
+from flask_sock import Sock
 from database import Database
 from models import *
+from ingest import IngestBuffer, IngestQueueFull, IngestTimeout
+from state import LocationState
+from recent import RecentSamples
+from partitions import PartitionManager
+from compaction import Compactor, DWELL_MAX_GAP
+from analytics import compute_lobby_analytics
+from channel import IngestChannel
+from maps import MapCache
+from codec import parse_timestamp, parse_location_sample
 from datetime import datetime
+import atexit
+import json
+import math
+import os
+import threading
+import time
+import zlib
 
 app = Flask(__name__)
 CORS(app)
+sock = Sock(app)
 db = Database()
+partition_manager = PartitionManager(Database(initialize=False))
+ingest_buffer = IngestBuffer(Database(initialize=False), partition_manager)
+compactor = Compactor(Database(initialize=False))
+location_state = LocationState()
+location_state.warm(db.get_recent_latest_locations(datetime.utcnow() - location_state.presence_timeout))
+map_cache = MapCache()
+replay_slots = threading.BoundedSemaphore(int(os.getenv('LOCATION_REPLAY_MAX_CONCURRENT', '8')))
+# Upper bound on the time bins of the analytics co-presence grid
+ANALYTICS_MAX_BINS = int(os.getenv('LOCATION_ANALYTICS_MAX_BINS', '500000'))
+recent_samples = RecentSamples()
+recent_since = datetime.utcnow() - recent_samples.window
+recent_samples.warm(db.get_samples_since(recent_since), recent_since)
+
+# Helper functions
+def ingest_samples(samples, durable: bool = False) -> int:
+    """Queue changed samples for persistence and apply all of them to the in-memory latest state.
+
+    Returns how many samples were suppressed as unchanged.
+    """
+    changed = location_state.select_changed(samples)
+    if changed:
+        ingest_buffer.submit(changed, durable=durable)
+        recent_samples.append(changed)
+    changed_ids = {id(sample) for sample in changed}
+    for sample in samples:
+        location_state.apply(LatestLocation.from_sample(sample), written=id(sample) in changed_ids)
+    return len(samples) - len(changed)
+
+def find_latest_location(lobby_id: str, user_id: str):
+    """Get a user's latest location from memory, confirming it against the database if needed"""
+    latest_location = location_state.get_user(lobby_id, user_id)
+    if not latest_location:
+        latest_location = location_state.confirm_user(
+            lobby_id, user_id, db.get_latest_location(user_id, lobby_id)
+        )
+    return latest_location
+
+def latest_location_dict(latest: LatestLocation) -> dict:
+    return {
+        'user_id': latest.user_id,
+        'room_id': latest.room_id,
+        'is_speaking': latest.is_speaking,
+        'is_alone': latest.is_alone,
+        'group': latest.group,
+        'is_hiding': latest.is_hiding,
+        'last_seen_at': latest.at.isoformat() + "Z"
+    }
+
+def occupancy_dict(rooms: dict) -> dict:
+    return {
+        'total': sum(len(users) for users in rooms.values()),
+        'rooms': [{
+            'room_id': room_id,
+            'count': len(users),
+            'users': users
+        } for room_id, users in rooms.items()]
+    }
+
+def is_durable_request() -> bool:
+    """Whether the client asked to be acknowledged only after the commit"""
+    return request.args.get('durable', 'false').lower() in ('1', 'true')
+
+def queue_full_response(e: IngestQueueFull):
+    return jsonify({'error': str(e)}), 429, {'Retry-After': str(e.retry_after)}
 
 # API Routes
 @app.route('/location/track', methods=['POST'])
@@ -15,27 +97,72 @@ def track_location():
     try:
         data = request.get_json()
         
-        # Validate required fields
-        required_fields = ['userId', 'lobbyId', 'roomId', 'at']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'Missing required field: {field}'}), 400
-        
-        # Create location sample
-        location = LocationSample(
-            user_id=data['userId'],
-            lobby_id=data['lobbyId'],
-            room_id=data['roomId'],
-            is_speaking=data.get('isSpeaking', False),
-            group=data.get('group', []),
-            is_hiding=data.get('isHiding', False),
-            at=data['at']
-        )
+        try:
+            location = parse_location_sample(data)
+            partition_manager.check(location)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Queue location for the next group commit
+        suppressed = ingest_samples([location], durable=is_durable_request())
+        
+        return jsonify({'accepted': True, 'suppressed': suppressed > 0}), 200
         
-        # Store location
-        db.track_location(location)
+    except IngestQueueFull as e:
+        return queue_full_response(e)
+    except IngestTimeout as e:
+        return jsonify({'error': str(e)}), 504
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/location/track/batch', methods=['POST'])
+def track_location_batch():
+    """Append many location samples (any users/lobbies) in one transaction"""
+    try:
+        data = request.get_json()
+        samples = data.get('samples') if isinstance(data, dict) else data
+        if not isinstance(samples, list):
+            return jsonify({'error': 'Expected a list of samples'}), 400
+        
+        # Validate per item, bad rows are reported without failing the batch
+        locations = []
+        rejected = []
+        for index, item in enumerate(samples):
+            try:
+                location = parse_location_sample(item)
+                partition_manager.check(location)
+                locations.append(location)
+            except ValueError as e:
+                rejected.append({'index': index, 'error': str(e)})
         
-        return jsonify({'accepted': True}), 200
+        suppressed = ingest_samples(locations, durable=is_durable_request()) if locations else 0
+        
+        return jsonify({
+            'accepted': len(locations),
+            'suppressed': suppressed,
+            'rejected': rejected
+        }), 200
+        
+    except IngestQueueFull as e:
+        return queue_full_response(e)
+    except IngestTimeout as e:
+        return jsonify({'error': str(e)}), 504
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@sock.route('/location/ws')
+def location_channel(ws):
+    """Long-lived websocket channel streaming one user's location samples into ingest"""
+    IngestChannel(ws, ingest_samples, partition_manager.check).serve()
+
+@app.route('/location/ingest/metrics', methods=['GET'])
+def get_ingest_metrics():
+    """Get ingest queue and flush metrics"""
+    try:
+        metrics = ingest_buffer.metrics()
+        metrics['suppressed'] = location_state.suppressed
+        metrics.update(recent_samples.metrics())
+        return jsonify(metrics), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -44,15 +171,15 @@ def track_location():
 def get_latest_location(lobby_id, user_id):
     """Get the latest known location for a user"""
     try:
-        latest_location = db.get_latest_location(user_id, lobby_id)
-        
+        latest_location = find_latest_location(lobby_id, user_id)
         if not latest_location:
             return jsonify({'error': 'No location data found for user in this lobby'}), 404
         
         response = LatestLocationResponse(
-            room_id=latest_location['room_id'],
-            is_alone=latest_location['is_alone'],
-            last_seen_at=latest_location['last_seen_at']
+            room_id=latest_location.room_id,
+            is_alone=latest_location.is_alone,
+            group=latest_location.group,
+            last_seen_at=latest_location.at.isoformat() + "Z"
         )
         
         return jsonify(asdict(response)), 200
@@ -63,34 +190,269 @@ def get_latest_location(lobby_id, user_id):
 # Additional endpoints for debugging and monitoring
 @app.route('/location/lobbies/<lobby_id>/users/<user_id>/history', methods=['GET'])
 def get_location_history(lobby_id, user_id):
-    """Get location history for a user (for debugging)"""
+    """Get location history for a user as dwell intervals (raw=true for recent raw samples)"""
     try:
         limit = request.args.get('limit', 10, type=int)
-        history = db.get_location_history(user_id, lobby_id, limit)
+        try:
+            since = parse_timestamp(request.args['since']) if 'since' in request.args else None
+            until = parse_timestamp(request.args['until']) if 'until' in request.args else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        if request.args.get('raw', 'false').lower() in ('1', 'true'):
+            history = recent_samples.get_user_history(user_id, lobby_id, limit, since, until)
+            if history is None:
+                history = db.get_location_history(user_id, lobby_id, limit, since, until)
+            history = [asdict(loc) for loc in history]
+        else:
+            history = [{
+                'room_id': interval.room_id,
+                'is_speaking': interval.is_speaking,
+                'is_hiding': interval.is_hiding,
+                'enter_at': interval.enter_at.isoformat() + "Z",
+                'leave_at': interval.leave_at.isoformat() + "Z",
+                'sample_count': interval.sample_count
+            } for interval in db.get_dwell_history(user_id, lobby_id, limit, DWELL_MAX_GAP, since, until)]
         
         return jsonify({
             'user_id': user_id,
             'lobby_id': lobby_id,
-            'history': [asdict(loc) for loc in history]
+            'history': history
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/location/lobbies/<lobby_id>/export', methods=['GET'])
+def export_location_history(lobby_id):
+    """Stream raw location samples of a lobby (or one user with userId) as NDJSON, gzip=true to compress"""
+    try:
+        user_id = request.args.get('userId')
+        fetch_size = request.args.get('fetchSize', 5000, type=int)
+        if fetch_size <= 0:
+            return jsonify({'error': 'fetchSize must be positive'}), 400
+        try:
+            since = parse_timestamp(request.args['since']) if 'since' in request.args else None
+            until = parse_timestamp(request.args['until']) if 'until' in request.args else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        compress = request.args.get('gzip', 'false').lower() in ('1', 'true')
+        
+        lines = db.stream_location_history(lobby_id, user_id, since, until, fetch_size)
+        
+        def generate():
+            # One chunk per fetched batch of rows
+            compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31: gzip container
+            batch = []
+            for line in lines:
+                batch.append(line)
+                if len(batch) >= fetch_size:
+                    chunk = ('\n'.join(batch) + '\n').encode()
+                    batch = []
+                    yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH) if compressor else chunk
+            chunk = ('\n'.join(batch) + '\n').encode() if batch else b''
+            yield compressor.compress(chunk) + compressor.flush() if compressor else chunk
+        
+        headers = {'Content-Disposition': f'attachment; filename="location-history-{lobby_id}.ndjson"'}
+        if compress:
+            headers['Content-Encoding'] = 'gzip'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers=headers)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/location/lobbies/<lobby_id>/replay', methods=['GET'])
+def replay_lobby(lobby_id):
+    """Replay a lobby's movements as Server-Sent Events, paced at ?speed= times real time"""
+    try:
+        speed = request.args.get('speed', 1.0, type=float)
+        if speed <= 0:
+            return jsonify({'error': 'speed must be positive'}), 400
+        try:
+            since = parse_timestamp(request.args['since']) if 'since' in request.args else None
+            until = parse_timestamp(request.args['until']) if 'until' in request.args else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        if not replay_slots.acquire(blocking=False):
+            return jsonify({'error': 'Too many replays in progress'}), 503, {'Retry-After': '5'}
+        
+        def generate():
+            started = None
+            first_at = None
+            count = 0
+            for sample in db.stream_lobby_replay(lobby_id, since, until):
+                if started is None:
+                    started = time.monotonic()
+                    first_at = sample.at
+                # Sleep until the sample is due at the requested speed, outside any transaction
+                delay = started + (sample.at - first_at).total_seconds() / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                count += 1
+                yield 'event: location\ndata: ' + json.dumps({
+                    'user_id': sample.user_id,
+                    'room_id': sample.room_id,
+                    'is_speaking': sample.is_speaking,
+                    'is_hiding': sample.is_hiding,
+                    'at': sample.at.isoformat() + "Z"
+                }) + '\n\n'
+            yield 'event: end\ndata: ' + json.dumps({'count': count}) + '\n\n'
+        
+        # Released when the response is closed, also if the client leaves before the first event
+        response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        response.call_on_close(replay_slots.release)
+        return response
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/location/lobbies/<lobby_id>/locations', methods=['GET'])
 def get_lobby_locations(lobby_id):
     """Get latest locations of all users in a lobby (for debugging)"""
     try:
-        locations = db.get_lobby_locations(lobby_id)
+        locations = location_state.get_lobby(lobby_id)
+        if locations is None:
+            locations = location_state.load_lobby(lobby_id, db.get_lobby_locations(lobby_id))
         
         return jsonify({
             'lobby_id': lobby_id,
-            'locations': locations
+            'locations': [latest_location_dict(latest) for latest in locations]
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/location/lobbies/latest', methods=['POST'])
+def get_latest_locations_for_lobbies():
+    """Get latest locations of all users in many lobbies ({"lobbyIds": [...]}, or every active lobby)"""
+    try:
+        data = request.get_json(silent=True) or {}
+        lobby_ids = data.get('lobbyIds')
+        if lobby_ids is None:
+            lobby_ids = location_state.get_active_lobby_ids()
+        elif not isinstance(lobby_ids, list) or not all(isinstance(i, str) for i in lobby_ids):
+            return jsonify({'error': 'lobbyIds must be a list of lobby ids'}), 400
+        
+        # Served from memory, lobbies not loaded yet are read in one query
+        lobbies = location_state.get_lobbies(lobby_ids)
+        missing = [lobby_id for lobby_id, locations in lobbies.items() if locations is None]
+        if missing:
+            for lobby_id, persisted in db.get_locations_for_lobbies(missing).items():
+                lobbies[lobby_id] = location_state.load_lobby(lobby_id, persisted)
+        
+        return jsonify({
+            'lobbies': {
+                lobby_id: [latest_location_dict(latest) for latest in locations]
+                for lobby_id, locations in lobbies.items()
+            }
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/location/lobbies/<lobby_id>/occupancy', methods=['GET'])
+def get_lobby_occupancy(lobby_id):
+    """Get how many (and which) players are in each room of a lobby right now"""
+    try:
+        response = occupancy_dict(location_state.get_occupancy(lobby_id))
+        response['lobby_id'] = lobby_id
+        
+        return jsonify(response), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/location/lobbies/<lobby_id>/proximity', methods=['GET'])
+def get_lobby_proximity(lobby_id):
+    """Get players present within k rooms (map hops) of a user (?userId=) or a room (?roomId=)"""
+    try:
+        k = request.args.get('k', 1, type=int)
+        if k < 0:
+            return jsonify({'error': 'k must not be negative'}), 400
+        user_id = request.args.get('userId')
+        room_id = request.args.get('roomId')
+        if bool(user_id) == bool(room_id):
+            return jsonify({'error': 'Expected exactly one of userId or roomId'}), 400
+        
+        if user_id:
+            latest_location = find_latest_location(lobby_id, user_id)
+            if not latest_location:
+                return jsonify({'error': 'No location data found for user in this lobby'}), 404
+            room_id = latest_location.room_id
+        
+        graph = map_cache.get_lobby_graph(lobby_id)
+        if not graph:
+            return jsonify({'error': 'Map not found for lobby'}), 404
+        
+        occupancy = location_state.get_occupancy(lobby_id)
+        players = [{
+            'user_id': occupant,
+            'room_id': room,
+            'distance': hops
+        } for room, hops in graph.within(room_id, k) for occupant in occupancy.get(room, ()) if occupant != user_id]
+        
+        return jsonify({
+            'lobby_id': lobby_id,
+            'map_id': graph.map_id,
+            'map_version': graph.version,
+            'room_id': room_id,
+            'k': k,
+            'players': players
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/location/occupancy', methods=['GET'])
+def get_occupancy_snapshot():
+    """Get room occupancy for the given lobbies (?lobbyId=...), or every active lobby"""
+    try:
+        lobby_ids = request.args.getlist('lobbyId') or location_state.get_active_lobby_ids()
+        snapshot = location_state.get_occupancy_snapshot(lobby_ids)
+        
+        return jsonify({
+            'lobbies': {lobby_id: occupancy_dict(rooms) for lobby_id, rooms in snapshot.items()}
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/location/lobbies/<lobby_id>/analytics', methods=['GET'])
+def get_lobby_analytics(lobby_id):
+    """Get movement analytics for a lobby: time alone, dwell time per room and co-presence"""
+    try:
+        try:
+            since = parse_timestamp(request.args['since']) if 'since' in request.args else None
+            until = parse_timestamp(request.args['until']) if 'until' in request.args else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        resolution = request.args.get('resolution', 1.0, type=float)
+        if not (resolution > 0 and math.isfinite(resolution)):
+            return jsonify({'error': 'resolution must be a positive number'}), 400
+        
+        if recent_samples.covers(since):
+            columns = recent_samples.get_lobby_columns(lobby_id, since, until)
+        else:
+            user_ids, room_ids, samples = db.get_lobby_sample_columns(lobby_id, since, until)
+            columns = (user_ids, room_ids, samples['user'], samples['room'], samples['ts'], samples['flags'])
+        try:
+            response = compute_lobby_analytics(
+                *columns,
+                max_gap=DWELL_MAX_GAP.total_seconds(),
+                resolution=resolution,
+                max_bins=ANALYTICS_MAX_BINS
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        response['lobby_id'] = lobby_id
+        
+        return jsonify(response), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
@@ -110,4 +472,11 @@ def health():
         }), 500
 
 if __name__ == '__main__':
+    # The debug reloader runs this module in a watcher process as well,
+    # only the serving process should flush, compact and maintain partitions
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        partition_manager.start()
+        ingest_buffer.start()
+        atexit.register(ingest_buffer.stop)
+        compactor.start()
     app.run(host='0.0.0.0', port=3008, debug=True)
\ No newline at end of file
@@ -0,0 +1,186 @@
+import json
+import time
+import os
+from codec import SAMPLE_RECORD, ID_MAX_LENGTH, parse_compact_sample, decode_samples
+from ingest import IngestQueueFull
+
+class ProtocolError(Exception):
+    """Raised for frames that break the channel protocol; the connection is closed"""
+
+class IngestChannel:
+    """One websocket ingest connection.
+
+    The client opens with {"type": "hello", "userId", "lobbyId"}, which binds
+    the connection to that lobby and user for its lifetime, and gets back
+    {"type": "welcome", "window", "recordSize"}. After that every text frame is
+    a compact sample [seq, roomId, atMillis, flags, group?] or a list of them.
+    Samples go through the same ingest pipeline as /location/track.
+
+    Binary frames carry fixed-width records (see codec.SAMPLE_RECORD) that
+    refer to users and rooms by index into tables interned for the session:
+    user 0 is the hello user, followed by any "users" listed in the hello (for
+    clients relaying other players), and rooms are the hello's "rooms". Both
+    can be extended with {"type": "intern", "users", "rooms"}. In both formats
+    seq is strictly increasing.
+
+    The server acknowledges cumulatively with
+    {"type": "ack", "seq", "accepted", "suppressed", "rejected": [{"seq", "error"}]},
+    coalescing acks while more frames are already waiting. A client keeps at
+    most `window` samples unacknowledged. While the ingest queue is full the
+    server sends {"type": "busy", "retryAfter"} and stops reading until the
+    samples are taken, so the client's window fills and it backs off.
+    """
+
+    def __init__(self, ws, ingest, check=None):
+        self.ws = ws
+        self.ingest = ingest
+        self.check = check  # raises ValueError for samples that cannot be stored
+        self.window = int(os.getenv('LOCATION_WS_WINDOW', '500'))
+        self.hello_timeout = float(os.getenv('LOCATION_WS_HELLO_TIMEOUT', '10'))
+        self.user_id = None
+        self.lobby_id = None
+        self.users = []  # interned user ids for binary frames
+        self.rooms = []  # interned room ids for binary frames
+        self.last_seq = -1
+        self.unacked = 0
+        self.accepted = 0
+        self.suppressed = 0
+        self.rejected = []
+
+    def send(self, message: dict):
+        self.ws.send(json.dumps(message))
+
+    def handshake(self):
+        message = self.ws.receive(timeout=self.hello_timeout)
+        if message is None:
+            raise ProtocolError('Expected a hello frame')
+        try:
+            hello = json.loads(message)
+        except ValueError:
+            raise ProtocolError('Frames must be JSON')
+        if not isinstance(hello, dict) or hello.get('type') != 'hello':
+            raise ProtocolError('Expected a hello frame')
+        for field in ['userId', 'lobbyId']:
+            if not isinstance(hello.get(field), str) or not hello[field]:
+                raise ProtocolError(f'{field} must be a non-empty string')
+            if len(hello[field]) > ID_MAX_LENGTH:
+                raise ProtocolError(f'{field} must be at most {ID_MAX_LENGTH} characters')
+
+        self.user_id = hello['userId']
+        self.lobby_id = hello['lobbyId']
+        self.users = [self.user_id]
+        self.intern(hello)
+        self.send({'type': 'welcome', 'window': self.window, 'recordSize': SAMPLE_RECORD.size})
+
+    def intern(self, message: dict):
+        """Extend the session's user and room tables"""
+        for field, table in [('users', self.users), ('rooms', self.rooms)]:
+            ids = message.get(field, [])
+            if not isinstance(ids, list) or not all(isinstance(i, str) and i for i in ids):
+                raise ProtocolError(f'{field} must be a list of non-empty strings')
+            if any(len(i) > ID_MAX_LENGTH for i in ids):
+                raise ProtocolError(f'{field} must be at most {ID_MAX_LENGTH} characters each')
+            table.extend(ids)
+            if len(table) > 0x10000:
+                raise ProtocolError(f'At most {0x10000} {field} can be interned')
+
+    def decode(self, message):
+        """Turn a frame into (seq, LocationSample or error message) pairs, or None for control frames"""
+        if isinstance(message, (bytes, bytearray)):
+            try:
+                decoded = list(decode_samples(message, self.lobby_id, self.users, self.rooms))
+            except ValueError as e:
+                raise ProtocolError(str(e))
+            if not decoded:
+                raise ProtocolError('Expected at least one sample')
+            return decoded
+
+        try:
+            entries = json.loads(message)
+        except ValueError:
+            raise ProtocolError('Frames must be JSON')
+        if isinstance(entries, dict) and entries.get('type') == 'intern':
+            self.intern(entries)
+            return None
+        if not isinstance(entries, list) or not entries:
+            raise ProtocolError('Expected a sample or a list of samples')
+        if not isinstance(entries[0], list):
+            entries = [entries]
+
+        decoded = []
+        for entry in entries:
+            if not isinstance(entry, list) or not entry or not isinstance(entry[0], int):
+                raise ProtocolError('Sample must start with an integer seq')
+            try:
+                decoded.append((entry[0], parse_compact_sample(self.user_id, self.lobby_id, entry)))
+            except ValueError as e:
+                decoded.append((entry[0], str(e)))
+        return decoded
+
+    def handle(self, message):
+        """Decode one frame of samples and feed the valid ones to the ingest pipeline"""
+        decoded = self.decode(message)
+        if decoded is None:
+            return
+        if len(decoded) > self.window:
+            raise ProtocolError(f'A frame may carry at most {self.window} samples')
+
+        samples = []
+        for seq, sample in decoded:
+            if seq <= self.last_seq:
+                raise ProtocolError(f'seq must increase, got {seq} after {self.last_seq}')
+            self.last_seq = seq
+            if not isinstance(sample, str) and self.check:
+                try:
+                    self.check(sample)
+                except ValueError as e:
+                    sample = str(e)
+            if isinstance(sample, str):
+                self.rejected.append({'seq': seq, 'error': sample})
+            else:
+                samples.append(sample)
+
+        if samples:
+            # Hold the connection (and so the client) back until the queue takes the samples
+            while True:
+                try:
+                    self.suppressed += self.ingest(samples)
+                    break
+                except IngestQueueFull as e:
+                    self.send({'type': 'busy', 'retryAfter': e.retry_after})
+                    time.sleep(e.retry_after)
+        self.accepted += len(samples)
+        self.unacked += len(decoded)
+
+    def ack(self):
+        self.send({
+            'type': 'ack',
+            'seq': self.last_seq,
+            'accepted': self.accepted,
+            'suppressed': self.suppressed,
+            'rejected': self.rejected
+        })
+        self.unacked = 0
+        self.accepted = 0
+        self.suppressed = 0
+        self.rejected = []
+
+    def serve(self):
+        try:
+            self.handshake()
+            while True:
+                self.handle(self.ws.receive())
+                # Coalesce the ack while more frames are already waiting
+                while self.unacked < self.window // 2:
+                    message = self.ws.receive(timeout=0)
+                    if message is None:
+                        break
+                    self.handle(message)
+                if self.unacked:
+                    self.ack()
+        except ProtocolError as e:
+            # Frames before the bad one were ingested, the client must not resend them
+            if self.unacked:
+                self.ack()
+            self.send({'type': 'error', 'error': str(e)})
+            self.ws.close(reason=1008, message=str(e))
@@ -0,0 +1,114 @@
+import struct
+from datetime import datetime, timedelta, timezone
+from models import LocationSample
+
+# Bits of the flags field of compact and binary samples (not the analytics.FLAG_* column bits)
+WIRE_FLAG_SPEAKING = 1
+WIRE_FLAG_HIDING = 2
+
+EPOCH = datetime(1970, 1, 1)
+
+# Length of the VARCHAR id columns samples are written to
+ID_MAX_LENGTH = 36
+
+# Latest epoch millisecond a datetime can hold
+MAX_AT_MILLIS = (datetime.max - EPOCH) // timedelta(milliseconds=1)
+
+# Fixed-width binary sample record, little-endian without padding:
+# seq uint32, user index uint16, room index uint16, flags uint8, epoch millis int64
+SAMPLE_RECORD = struct.Struct('<IHHBq')
+
+def parse_timestamp(value) -> datetime:
+    """Parse an ISO 8601 timestamp into a naive UTC datetime"""
+    if not isinstance(value, str):
+        raise ValueError('at must be an ISO 8601 timestamp string')
+    try:
+        at = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f'Invalid timestamp: {value}')
+    if at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    return at
+
+def parse_location_sample(data) -> LocationSample:
+    """Validate a track request body and build a LocationSample, raising ValueError if invalid"""
+    if not isinstance(data, dict):
+        raise ValueError('Location sample must be an object')
+    
+    # Validate required fields
+    required_fields = ['userId', 'lobbyId', 'roomId', 'at']
+    for field in required_fields:
+        if field not in data:
+            raise ValueError(f'Missing required field: {field}')
+    for field in ['userId', 'lobbyId', 'roomId']:
+        if not isinstance(data[field], str) or not data[field]:
+            raise ValueError(f'{field} must be a non-empty string')
+        if len(data[field]) > ID_MAX_LENGTH:
+            raise ValueError(f'{field} must be at most {ID_MAX_LENGTH} characters')
+    for field in ['isSpeaking', 'isHiding']:
+        if not isinstance(data.get(field, False), bool):
+            raise ValueError(f'{field} must be a boolean')
+    # A client-sent group is ignored, groups are computed from rooms
+    
+    return LocationSample(
+        user_id=data['userId'],
+        lobby_id=data['lobbyId'],
+        room_id=data['roomId'],
+        is_speaking=data.get('isSpeaking', False),
+        is_hiding=data.get('isHiding', False),
+        at=parse_timestamp(data['at'])
+    )
+
+def parse_compact_sample(user_id: str, lobby_id: str, entry: list) -> LocationSample:
+    """Build a LocationSample from a compact JSON [seq, roomId, atMillis, flags, group?] entry
+
+    A trailing group, as sent by older clients, is ignored: groups are computed
+    by the service.
+    """
+    if len(entry) not in (4, 5):
+        raise ValueError('Sample must be [seq, roomId, atMillis, flags, group?]')
+    room_id, at_ms, flags = entry[1], entry[2], entry[3]
+    if not isinstance(room_id, str) or not room_id:
+        raise ValueError('roomId must be a non-empty string')
+    if len(room_id) > ID_MAX_LENGTH:
+        raise ValueError(f'roomId must be at most {ID_MAX_LENGTH} characters')
+    if not isinstance(at_ms, int) or isinstance(at_ms, bool) or not 0 <= at_ms <= MAX_AT_MILLIS:
+        raise ValueError(f'atMillis must be an integer between 0 and {MAX_AT_MILLIS}')
+    if not isinstance(flags, int) or isinstance(flags, bool):
+        raise ValueError('flags must be an integer')
+
+    return LocationSample(
+        user_id=user_id,
+        lobby_id=lobby_id,
+        room_id=room_id,
+        is_speaking=bool(flags & WIRE_FLAG_SPEAKING),
+        is_hiding=bool(flags & WIRE_FLAG_HIDING),
+        at=EPOCH + timedelta(milliseconds=at_ms)
+    )
+
+def encode_samples(records) -> bytes:
+    """Pack (seq, user index, room index, flags, atMillis) tuples into a binary frame"""
+    frame = bytearray(SAMPLE_RECORD.size * len(records))
+    for index, record in enumerate(records):
+        SAMPLE_RECORD.pack_into(frame, index * SAMPLE_RECORD.size, *record)
+    return bytes(frame)
+
+def decode_samples(frame, lobby_id: str, users: list, rooms: list):
+    """Yield (seq, LocationSample or error message) for each record of a binary frame
+
+    Records are unpacked straight from a memoryview of the frame; user and
+    room indexes refer to the ids interned for the session. A timestamp out
+    of range raises ValueError for the whole frame.
+    """
+    view = memoryview(frame)
+    if len(view) % SAMPLE_RECORD.size:
+        raise ValueError(f'Binary frames must be a whole number of {SAMPLE_RECORD.size}-byte records')
+    for seq, user, room, flags, at_ms in SAMPLE_RECORD.iter_unpack(view):
+        if not 0 <= at_ms <= MAX_AT_MILLIS:
+            raise ValueError(f'atMillis must be between 0 and {MAX_AT_MILLIS}')
+        if user >= len(users) or room >= len(rooms):
+            yield seq, 'Unknown user or room index'
+            continue
+        # Positional arguments are noticeably cheaper on this hot path
+        yield seq, LocationSample(users[user], lobby_id, rooms[room], bool(flags & WIRE_FLAG_SPEAKING),
+                                  bool(flags & WIRE_FLAG_HIDING), EPOCH + timedelta(0, 0, 0, at_ms))
@@ -0,0 +1,55 @@
+"""Compare decode throughput of the location sample formats.
+
+Run with `python codec_benchmark.py [samples]`. Measures decoding frames
+alone, and turning them into LocationSample objects, without a database.
+"""
+import json
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from codec import (EPOCH, SAMPLE_RECORD, WIRE_FLAG_HIDING, WIRE_FLAG_SPEAKING, encode_samples, decode_samples,
+                   parse_compact_sample, parse_location_sample)
+
+def measure(name: str, decode, count: int, repeat: int = 5):
+    best = min(timed(decode) for _ in range(repeat))
+    print(f"{name:<28} {count / best / 1e6:6.2f} M samples/s  {best / count * 1e9:8.1f} ns/sample")
+
+def timed(decode) -> float:
+    started = time.perf_counter()
+    decode()
+    return time.perf_counter() - started
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    frame_size = 500
+    lobby_id = str(uuid.uuid4())
+    users = [str(uuid.uuid4()) for _ in range(8)]
+    rooms = [str(uuid.uuid4()) for _ in range(20)]
+    start_ms = (datetime.utcnow() - EPOCH) // timedelta(milliseconds=1)
+    records = [(seq, seq % len(users), seq % len(rooms), seq % 4, start_ms + seq * 50) for seq in range(count)]
+
+    rest_frames = [json.dumps([{
+        'userId': users[user],
+        'lobbyId': lobby_id,
+        'roomId': rooms[room],
+        'isSpeaking': bool(flags & WIRE_FLAG_SPEAKING),
+        'isHiding': bool(flags & WIRE_FLAG_HIDING),
+        'at': (EPOCH + timedelta(milliseconds=at_ms)).isoformat() + 'Z'
+    } for _, user, room, flags, at_ms in records[i:i + frame_size]]) for i in range(0, count, frame_size)]
+    compact_frames = [json.dumps([[seq, rooms[room], at_ms, flags] for seq, _, room, flags, at_ms in records[i:i + frame_size]])
+                      for i in range(0, count, frame_size)]
+    binary_frames = [encode_samples(records[i:i + frame_size]) for i in range(0, count, frame_size)]
+
+    print(f"{count} samples in frames of {frame_size}; bytes per sample: "
+          f"JSON {sum(map(len, rest_frames)) / count:.0f}, compact JSON {sum(map(len, compact_frames)) / count:.0f}, "
+          f"binary {sum(map(len, binary_frames)) / count:.0f}")
+    measure('decode only: JSON objects', lambda: [json.loads(frame) for frame in rest_frames], count)
+    measure('decode only: compact JSON', lambda: [json.loads(frame) for frame in compact_frames], count)
+    measure('decode only: binary records', lambda: [list(SAMPLE_RECORD.iter_unpack(frame)) for frame in binary_frames], count)
+    measure('to samples: JSON objects', lambda: [parse_location_sample(item) for frame in rest_frames for item in json.loads(frame)], count)
+    measure('to samples: compact JSON', lambda: [parse_compact_sample(users[0], lobby_id, entry) for frame in compact_frames for entry in json.loads(frame)], count)
+    measure('to samples: binary records', lambda: [sample for frame in binary_frames for _, sample in decode_samples(frame, lobby_id, users, rooms)], count)
+
+if __name__ == '__main__':
+    main()
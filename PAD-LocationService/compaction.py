@@ -0,0 +1,71 @@
+import threading
+import os
+from datetime import datetime, timedelta
+
+# Consecutive samples further apart than this start a new dwell interval
+DWELL_MAX_GAP = timedelta(seconds=float(os.getenv('LOCATION_DWELL_MAX_GAP', '60')))
+
+class Compactor:
+    """Background job collapsing raw location samples into dwell intervals.
+
+    Raw samples are compacted in steps up to a watermark that trails the
+    current time by a grace period, leaving room for late samples. Samples
+    arriving below the watermark anyway queue their user, whose intervals are
+    rebuilt from the late sample on the next pass. Partitions are only expired
+    once they lie entirely below the watermark and every queued sample.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.grace = timedelta(seconds=float(os.getenv('LOCATION_COMPACTION_GRACE', '300')))
+        self.step = timedelta(seconds=float(os.getenv('LOCATION_COMPACTION_STEP', '3600')))
+        self.interval = float(os.getenv('LOCATION_COMPACTION_INTERVAL', '60'))
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def recompact(self):
+        """Rebuild the dwell intervals of users with samples that arrived below the watermark"""
+        recompactions = self.db.get_recompactions()
+        if not recompactions:
+            return
+        days = self.db.get_partitions()
+        floor = datetime.combine(min(days), datetime.min.time()) if days else datetime.min
+        for lobby_id, user_id, _ in recompactions:
+            if self.stopped.is_set():
+                return
+            runs, inserted = self.db.recompact_locations(lobby_id, user_id, DWELL_MAX_GAP, floor)
+            if runs:
+                print(f"✅ Recompacted late location samples of {user_id} in {lobby_id} into {runs} dwell intervals")
+
+    def compact(self):
+        """Compact everything between the watermark and now minus the grace period"""
+        self.recompact()
+        target = datetime.utcnow() - self.grace
+        watermark = self.db.get_compaction_watermark()
+        if watermark is None:
+            # First run: start at the oldest raw partition
+            days = self.db.get_partitions()
+            watermark = datetime.combine(min(days), datetime.min.time()) if days else target
+
+        while watermark < target and not self.stopped.is_set():
+            until = min(target, watermark + self.step)
+            runs, inserted = self.db.compact_locations(watermark, until, DWELL_MAX_GAP)
+            if runs:
+                print(f"✅ Compacted location samples up to {until.isoformat()}Z into {inserted} new dwell intervals")
+            watermark = until
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"❌ Location compaction failed: {e}")
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='location-compaction', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
@@ -1,38 +1,68 @@
 import psycopg2
-import json
-from psycopg2.extras import RealDictCursor
-from models import LocationSample, LocationHistory
+from psycopg2.extras import RealDictCursor, execute_values
+from models import LocationSample, LocationHistory, LatestLocation, DwellInterval
 import os
-from datetime import datetime
+import io
+import heapq
+from datetime import datetime, date, timedelta
+from analytics import parse_binary_copy
 
 class Database:
-    def __init__(self):
+    def __init__(self, initialize: bool = True):
         self.connection = None
         self.connect()
-        self.init_db()
+        if initialize:
+            self.init_db()
 
     def connect(self):
         """Connect to PostgreSQL database"""
         try:
-            self.connection = psycopg2.connect(
-                host=os.getenv('DB_HOST', 'localhost'),
-                database=os.getenv('DB_NAME', 'locationdb'),
-                user=os.getenv('DB_USER', 'postgres'),
-                password=os.getenv('DB_PASSWORD', 'password'),
-                port=os.getenv('DB_PORT', '5432')
-            )
+            self.connection = self._open_connection()
             print("✅ Connected to PostgreSQL")
         except Exception as e:
             print(f"❌ Database connection failed: {e}")
             raise
 
+    def _open_connection(self):
+        return psycopg2.connect(
+            host=os.getenv('DB_HOST', 'localhost'),
+            database=os.getenv('DB_NAME', 'locationdb'),
+            user=os.getenv('DB_USER', 'postgres'),
+            password=os.getenv('DB_PASSWORD', 'password'),
+            port=os.getenv('DB_PORT', '5432')
+        )
+
     def init_db(self):
         """Initialize database tables"""
         try:
             with self.connection.cursor() as cursor:
+                cursor.execute("SELECT to_regclass('latest_location') IS NULL")
+                backfill_latest = cursor.fetchone()[0]
+                
+                cursor.execute("""
+                    SELECT relkind FROM pg_class
+                    WHERE oid = to_regclass('location_history')
+                """)
+                result = cursor.fetchone()
+                migrate_legacy = result is not None and result[0] == 'r'
+                
+                if migrate_legacy:
+                    # location_history used to be a single heap, move it aside and copy it below
+                    cursor.execute("""
+                        DROP INDEX IF EXISTS idx_location_user_lobby;
+                        DROP INDEX IF EXISTS idx_location_lobby;
+                        DROP INDEX IF EXISTS idx_location_recorded_at;
+                        ALTER TABLE location_history RENAME TO location_history_legacy;
+                        ALTER SEQUENCE IF EXISTS location_history_id_seq RENAME TO location_history_legacy_id_seq;
+                    """)
+                
+                # location_history is range partitioned by recorded_at, one partition per day.
+                # Partitions are created and expired by PartitionManager.
+                # group_users holds client-sent groups of older samples; groups are now
+                # computed by the service from rooms and no longer written.
                 cursor.execute("""
                     CREATE TABLE IF NOT EXISTS location_history (
-                        id SERIAL PRIMARY KEY,
+                        id BIGSERIAL,
                         user_id VARCHAR(36) NOT NULL,
                         lobby_id VARCHAR(36) NOT NULL,
                         room_id VARCHAR(36) NOT NULL,
@@ -40,13 +70,82 @@ class Database:
                         group_users JSONB DEFAULT '[]',
                         is_hiding BOOLEAN DEFAULT FALSE,
                         recorded_at TIMESTAMP NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (id, recorded_at)
+                    ) PARTITION BY RANGE (recorded_at);
+
+                    CREATE INDEX IF NOT EXISTS idx_location_user_lobby_recorded_at
+                        ON location_history (user_id, lobby_id, recorded_at DESC);
+
+                    CREATE TABLE IF NOT EXISTS latest_location (
+                        lobby_id VARCHAR(36) NOT NULL,
+                        user_id VARCHAR(36) NOT NULL,
+                        room_id VARCHAR(36) NOT NULL,
+                        is_speaking BOOLEAN DEFAULT FALSE,
+                        group_users JSONB DEFAULT '[]',
+                        is_hiding BOOLEAN DEFAULT FALSE,
+                        recorded_at TIMESTAMP NOT NULL,
+                        PRIMARY KEY (lobby_id, user_id)
+                    );
+
+                    CREATE TABLE IF NOT EXISTS location_dwell (
+                        id BIGSERIAL PRIMARY KEY,
+                        lobby_id VARCHAR(36) NOT NULL,
+                        user_id VARCHAR(36) NOT NULL,
+                        room_id VARCHAR(36) NOT NULL,
+                        is_speaking BOOLEAN DEFAULT FALSE,
+                        is_hiding BOOLEAN DEFAULT FALSE,
+                        enter_at TIMESTAMP NOT NULL,
+                        leave_at TIMESTAMP NOT NULL,
+                        sample_count INTEGER NOT NULL
+                    );
+
+                    CREATE INDEX IF NOT EXISTS idx_dwell_user_lobby_enter_at
+                        ON location_dwell (user_id, lobby_id, enter_at DESC);
+
+                    CREATE TABLE IF NOT EXISTS location_compaction (
+                        id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                        compacted_until TIMESTAMP NOT NULL
                     );
 
-                    CREATE INDEX IF NOT EXISTS idx_location_user_lobby ON location_history (user_id, lobby_id);
-                    CREATE INDEX IF NOT EXISTS idx_location_lobby ON location_history (lobby_id);
-                    CREATE INDEX IF NOT EXISTS idx_location_recorded_at ON location_history (recorded_at DESC);
+                    -- Users with samples written below the watermark, to be compacted again from "since"
+                    CREATE TABLE IF NOT EXISTS location_recompaction (
+                        lobby_id VARCHAR(36) NOT NULL,
+                        user_id VARCHAR(36) NOT NULL,
+                        since TIMESTAMP NOT NULL,
+                        PRIMARY KEY (lobby_id, user_id)
+                    );
                 """)
+                
+                if migrate_legacy:
+                    cursor.execute("""
+                        SELECT DISTINCT date_trunc('day', recorded_at)::date
+                        FROM location_history_legacy
+                    """)
+                    for (day,) in cursor.fetchall():
+                        self._create_partition(cursor, day)
+                    cursor.execute("""
+                        INSERT INTO location_history
+                        (id, user_id, lobby_id, room_id, is_speaking, group_users, is_hiding, recorded_at, created_at)
+                        SELECT id, user_id, lobby_id, room_id, is_speaking, group_users, is_hiding, recorded_at, created_at
+                        FROM location_history_legacy;
+
+                        SELECT setval('location_history_id_seq', COALESCE((SELECT MAX(id) FROM location_history), 0) + 1, false);
+
+                        DROP TABLE location_history_legacy;
+                    """)
+                    print("✅ Migrated location_history to a partitioned table")
+                
+                if backfill_latest:
+                    # Seed latest_location from existing history the first time it is created
+                    cursor.execute("""
+                        INSERT INTO latest_location
+                        (lobby_id, user_id, room_id, is_speaking, group_users, is_hiding, recorded_at)
+                        SELECT DISTINCT ON (lobby_id, user_id)
+                            lobby_id, user_id, room_id, is_speaking, group_users, is_hiding, recorded_at
+                        FROM location_history
+                        ORDER BY lobby_id, user_id, recorded_at DESC
+                    """)
                 self.connection.commit()
                 print("✅ Database tables created")
                 
@@ -54,71 +153,239 @@ class Database:
             print(f"❌ Database initialization failed: {e}")
             raise
 
-    def track_location(self, location: LocationSample):
-        """Store a location sample"""
+    def _partition_name(self, day: date) -> str:
+        return f"location_history_p{day.strftime('%Y%m%d')}"
+
+    # Partition DDL needs an exclusive lock on location_history; give up rather
+    # than queue every insert behind it while a long read is running
+    PARTITION_LOCK_TIMEOUT = '5s'
+
+    def _create_partition(self, cursor, day: date):
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self._partition_name(day)}
+            PARTITION OF location_history
+            FOR VALUES FROM (%s) TO (%s)
+        """, (day, day + timedelta(days=1)))
+
+    def create_partitions(self, days):
+        """Create the daily location_history partitions for the given dates"""
         try:
             with self.connection.cursor() as cursor:
+                cursor.execute("SET LOCAL lock_timeout = %s", (self.PARTITION_LOCK_TIMEOUT,))
+                for day in sorted(days):
+                    self._create_partition(cursor, day)
+                self.connection.commit()
+                
+        except Exception as e:
+            self.connection.rollback()
+            raise e
+
+    def get_partitions(self):
+        """Get the dates of the daily partitions currently attached to location_history"""
+        try:
+            with self.connection, self.connection.cursor() as cursor:
                 cursor.execute("""
+                    SELECT c.relname
+                    FROM pg_inherits i
+                    JOIN pg_class c ON c.oid = i.inhrelid
+                    WHERE i.inhparent = 'location_history'::regclass
+                """)
+                days = []
+                for (name,) in cursor.fetchall():
+                    try:
+                        days.append(datetime.strptime(name[len('location_history_p'):], '%Y%m%d').date())
+                    except ValueError:
+                        continue  # Not a daily partition managed by us
+                return days
+                
+        except Exception as e:
+            raise e
+
+    def expire_partition(self, day: date, detach: bool = False):
+        """Detach or drop the daily location_history partition for a date"""
+        try:
+            with self.connection.cursor() as cursor:
+                name = self._partition_name(day)
+                cursor.execute("SET LOCAL lock_timeout = %s", (self.PARTITION_LOCK_TIMEOUT,))
+                if detach:
+                    cursor.execute(f"ALTER TABLE location_history DETACH PARTITION {name}")
+                else:
+                    cursor.execute(f"DROP TABLE IF EXISTS {name}")
+                self.connection.commit()
+                
+        except Exception as e:
+            self.connection.rollback()
+            raise e
+
+    def track_locations(self, locations):
+        """Store many location samples with multi-row inserts in a single transaction"""
+        try:
+            with self.connection.cursor() as cursor:
+                execute_values(cursor, """
                     INSERT INTO location_history 
-                    (user_id, lobby_id, room_id, is_speaking, group_users, is_hiding, recorded_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """, (
+                    (user_id, lobby_id, room_id, is_speaking, is_hiding, recorded_at)
+                    VALUES %s
+                """, [(
                     location.user_id,
                     location.lobby_id,
                     location.room_id,
                     location.is_speaking,
-                    json.dumps(location.group),
                     location.is_hiding,
                     location.at
-                ))
+                ) for location in locations], page_size=1000)
+                self._upsert_latest_locations(cursor, locations)
+                self._mark_late_locations(cursor, locations)
                 self.connection.commit()
-                return True
+                return len(locations)
                 
         except Exception as e:
             self.connection.rollback()
             raise e
 
+    def _upsert_latest_locations(self, cursor, locations):
+        """Upsert the newest sample per (lobby, user) into latest_location, ignoring out-of-order ones"""
+        # A single INSERT ... ON CONFLICT may not touch the same row twice
+        newest = {}
+        for location in locations:
+            key = (location.lobby_id, location.user_id)
+            if key not in newest or newest[key].at <= location.at:
+                newest[key] = location
+        
+        execute_values(cursor, """
+            INSERT INTO latest_location
+            (lobby_id, user_id, room_id, is_speaking, is_hiding, recorded_at)
+            VALUES %s
+            ON CONFLICT (lobby_id, user_id) DO UPDATE SET
+                room_id = EXCLUDED.room_id,
+                is_speaking = EXCLUDED.is_speaking,
+                is_hiding = EXCLUDED.is_hiding,
+                recorded_at = EXCLUDED.recorded_at
+            WHERE latest_location.recorded_at <= EXCLUDED.recorded_at
+        """, [(
+            location.lobby_id,
+            location.user_id,
+            location.room_id,
+            location.is_speaking,
+            location.is_hiding,
+            location.at
+        ) for location in newest.values()], page_size=1000)
+
+    def _mark_late_locations(self, cursor, locations):
+        """Queue users with samples below the compaction watermark for recompaction
+
+        The watermark row is share-locked, so a compaction step either waits for
+        these samples to commit and sees them, or has already advanced the
+        watermark past them and they are queued here.
+        """
+        cursor.execute("SELECT compacted_until FROM location_compaction WHERE id = 1 FOR SHARE")
+        result = cursor.fetchone()
+        if result is None:
+            return
+        watermark = result[0]
+        
+        late = {}
+        for location in locations:
+            key = (location.lobby_id, location.user_id)
+            if location.at < watermark and (key not in late or location.at < late[key]):
+                late[key] = location.at
+        if late:
+            execute_values(cursor, """
+                INSERT INTO location_recompaction (lobby_id, user_id, since)
+                VALUES %s
+                ON CONFLICT (lobby_id, user_id) DO UPDATE SET
+                    since = LEAST(location_recompaction.since, EXCLUDED.since)
+            """, [(lobby_id, user_id, at) for (lobby_id, user_id), at in late.items()], page_size=1000)
+
+    def _row_to_latest_location(self, result) -> LatestLocation:
+        return LatestLocation(
+            lobby_id=result['lobby_id'],
+            user_id=result['user_id'],
+            room_id=result['room_id'],
+            is_speaking=result['is_speaking'],
+            is_hiding=result['is_hiding'],
+            at=result['recorded_at']
+        )
+
     def get_latest_location(self, user_id: str, lobby_id: str):
         """Get the latest location for a user in a lobby"""
         try:
-            with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
+            with self.connection, self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute("""
-                    SELECT room_id, is_speaking, group_users, is_hiding, recorded_at
-                    FROM location_history 
-                    WHERE user_id = %s AND lobby_id = %s 
-                    ORDER BY recorded_at DESC 
-                    LIMIT 1
-                """, (user_id, lobby_id))
+                    SELECT lobby_id, user_id, room_id, is_speaking, is_hiding, recorded_at
+                    FROM latest_location 
+                    WHERE lobby_id = %s AND user_id = %s
+                """, (lobby_id, user_id))
                 result = cursor.fetchone()
                 
                 if not result:
                     return None
                 
-                # Calculate if user is alone (group is empty or only contains themselves)
-                group_users = result['group_users'] or []
-                is_alone = len(group_users) == 0 or (len(group_users) == 1 and group_users[0] == user_id)
+                return self._row_to_latest_location(result)
+                
+        except Exception as e:
+            raise e
+
+    def get_recent_latest_locations(self, since: datetime):
+        """Get latest locations of all users seen since the given time, across lobbies"""
+        try:
+            with self.connection, self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    SELECT lobby_id, user_id, room_id, is_speaking, is_hiding, recorded_at
+                    FROM latest_location 
+                    WHERE recorded_at >= %s
+                """, (since,))
                 
-                return {
-                    'room_id': result['room_id'],
-                    'is_alone': is_alone,
-                    'last_seen_at': result['recorded_at'].isoformat() + "Z"
-                }
+                return [self._row_to_latest_location(result) for result in cursor.fetchall()]
                 
         except Exception as e:
             raise e
 
-    def get_location_history(self, user_id: str, lobby_id: str, limit: int = 10):
-        """Get location history for a user in a lobby"""
+    def get_samples_since(self, since: datetime, fetch_size: int = 10000):
+        """Yield (LocationSample, created_at, group) for every sample recorded since the given time
+
+        Reads through a server-side cursor on its own connection, oldest first.
+        group is the stored group_users of older samples, None when empty.
+        """
+        connection = self._open_connection()
         try:
-            with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
+            with connection, connection.cursor(name='location_samples_since') as cursor:
+                cursor.itersize = fetch_size
+                cursor.execute("""
+                    SELECT user_id, lobby_id, room_id, is_speaking, is_hiding, recorded_at, created_at,
+                           NULLIF(group_users, '[]'::jsonb)
+                    FROM location_history
+                    WHERE recorded_at >= %s
+                    ORDER BY recorded_at
+                """, (since,))
+                
+                for user_id, lobby_id, room_id, is_speaking, is_hiding, recorded_at, created_at, group in cursor:
+                    yield LocationSample(
+                        user_id=user_id,
+                        lobby_id=lobby_id,
+                        room_id=room_id,
+                        is_speaking=is_speaking,
+                        is_hiding=is_hiding,
+                        at=recorded_at
+                    ), created_at, group
+        finally:
+            connection.close()
+
+    def get_location_history(self, user_id: str, lobby_id: str, limit: int = 10,
+                             since: datetime = None, until: datetime = None):
+        """Get location history for a user in a lobby, optionally within [since, until)"""
+        try:
+            with self.connection, self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                # Bounds on recorded_at let Postgres prune partitions outside the range
                 cursor.execute("""
                     SELECT user_id, lobby_id, room_id, is_speaking, group_users, is_hiding, 
                            recorded_at, created_at
                     FROM location_history 
                     WHERE user_id = %s AND lobby_id = %s 
+                      AND (%s::timestamp IS NULL OR recorded_at >= %s)
+                      AND (%s::timestamp IS NULL OR recorded_at < %s)
                     ORDER BY recorded_at DESC 
                     LIMIT %s
-                """, (user_id, lobby_id, limit))
+                """, (user_id, lobby_id, since, since, until, until, limit))
                 
                 results = cursor.fetchall()
                 history = []
@@ -141,40 +408,407 @@ class Database:
         except Exception as e:
             raise e
 
+    def _page_user_samples(self, columns: str, user_id: str, lobby_id: str,
+                           since: datetime = None, until: datetime = None, page_size: int = 1000):
+        """Yield (id, recorded_at, *columns) rows of one user's samples in a lobby in time order
+
+        Rows are read page_size at a time with keyset paging on (recorded_at, id),
+        already in time order from the (user_id, lobby_id, recorded_at) index.
+        Every page is its own short transaction, so a slowly consumed stream
+        holds no snapshot or locks between pages.
+        """
+        last_at, last_id = since, None
+        while True:
+            with self.connection, self.connection.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT id, recorded_at, {columns}
+                    FROM location_history
+                    WHERE user_id = %s AND lobby_id = %s
+                      AND (%s::timestamp IS NULL OR recorded_at >= %s)
+                      AND (%s::bigint IS NULL OR (recorded_at, id) > (%s, %s))
+                      AND (%s::timestamp IS NULL OR recorded_at < %s)
+                    ORDER BY recorded_at, id
+                    LIMIT %s
+                """, (user_id, lobby_id, last_at, last_at, last_id, last_at, last_id,
+                      until, until, page_size))
+                rows = cursor.fetchall()
+            
+            yield from rows
+            if len(rows) < page_size:
+                return
+            last_id, last_at = rows[-1][0], rows[-1][1]
+
+    def _get_lobby_user_ids(self, lobby_id: str):
+        with self.connection, self.connection.cursor() as cursor:
+            cursor.execute("SELECT user_id FROM latest_location WHERE lobby_id = %s", (lobby_id,))
+            return [row[0] for row in cursor.fetchall()]
+
+    def stream_lobby_replay(self, lobby_id: str, since: datetime = None, until: datetime = None,
+                            page_size: int = 1000):
+        """Yield a lobby's raw samples in time order as LocationSample, merged from per-user pages
+
+        Each user's samples are paged with _page_user_samples and merged k-way.
+        """
+        def user_samples(user_id):
+            rows = self._page_user_samples("room_id, is_speaking, is_hiding",
+                                           user_id, lobby_id, since, until, page_size)
+            for _, recorded_at, room_id, is_speaking, is_hiding in rows:
+                yield LocationSample(
+                    user_id=user_id,
+                    lobby_id=lobby_id,
+                    room_id=room_id,
+                    is_speaking=is_speaking,
+                    is_hiding=is_hiding,
+                    at=recorded_at
+                )
+        
+        streams = [user_samples(user_id) for user_id in self._get_lobby_user_ids(lobby_id)]
+        yield from heapq.merge(*streams, key=lambda sample: sample.at)
+
+    def stream_location_history(self, lobby_id: str, user_id: str = None,
+                                since: datetime = None, until: datetime = None, fetch_size: int = 5000):
+        """Yield raw samples of a lobby (or one user in it) as JSON lines in recorded_at order
+
+        Each user's samples are paged fetch_size rows at a time with
+        _page_user_samples and merged k-way, so memory stays flat however many
+        rows match, the first line needs no sort of the whole result, and no
+        transaction is held for the length of the export.
+        """
+        user_ids = [user_id] if user_id is not None else self._get_lobby_user_ids(lobby_id)
+        # The row is rendered to JSON by Postgres, keys as in LocationHistory
+        columns = """
+            json_build_object(
+                'user_id', user_id,
+                'lobby_id', lobby_id,
+                'room_id', room_id,
+                'is_speaking', is_speaking,
+                'group', group_users,
+                'is_hiding', is_hiding,
+                'recorded_at', to_char(recorded_at, 'YYYY-MM-DD"T"HH24:MI:SS.US"Z"'),
+                'created_at', to_char(created_at, 'YYYY-MM-DD"T"HH24:MI:SS.US"Z"')
+            )::text
+        """
+        streams = [
+            self._page_user_samples(columns, user_id, lobby_id, since, until, fetch_size)
+            for user_id in user_ids
+        ]
+        for _, _, line in heapq.merge(*streams, key=lambda row: row[1]):
+            yield line
+
     def get_lobby_locations(self, lobby_id: str):
         """Get latest locations of all users in a lobby"""
         try:
-            with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
-                # This query gets the latest location for each user in the lobby
+            with self.connection, self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute("""
-                    SELECT DISTINCT ON (user_id) 
-                        user_id, room_id, is_speaking, group_users, is_hiding, recorded_at
-                    FROM location_history 
-                    WHERE lobby_id = %s 
-                    ORDER BY user_id, recorded_at DESC
+                    SELECT lobby_id, user_id, room_id, is_speaking, is_hiding, recorded_at
+                    FROM latest_location 
+                    WHERE lobby_id = %s
                 """, (lobby_id,))
                 
-                results = cursor.fetchall()
-                locations = []
+                return [self._row_to_latest_location(result) for result in cursor.fetchall()]
                 
-                for result in results:
-                    group_users = result['group_users'] or []
-                    is_alone = len(group_users) == 0 or (len(group_users) == 1 and group_users[0] == result['user_id'])
-                    
-                    locations.append({
-                        'user_id': result['user_id'],
-                        'room_id': result['room_id'],
-                        'is_speaking': result['is_speaking'],
-                        'is_alone': is_alone,
-                        'is_hiding': result['is_hiding'],
-                        'last_seen_at': result['recorded_at'].isoformat() + "Z"
-                    })
+        except Exception as e:
+            raise e
+
+    def get_locations_for_lobbies(self, lobby_ids) -> dict:
+        """Get latest locations of all users in each of the given lobbies, in one query"""
+        try:
+            with self.connection, self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    SELECT lobby_id, user_id, room_id, is_speaking, is_hiding, recorded_at
+                    FROM latest_location 
+                    WHERE lobby_id = ANY(%s)
+                """, (list(lobby_ids),))
                 
+                locations = {lobby_id: [] for lobby_id in lobby_ids}
+                for result in cursor.fetchall():
+                    locations[result['lobby_id']].append(self._row_to_latest_location(result))
                 return locations
                 
         except Exception as e:
             raise e
 
+    def get_lobby_sample_columns(self, lobby_id: str, since: datetime = None, until: datetime = None):
+        """Load a lobby's raw samples as columns for vectorized analytics
+
+        Returns (user_ids, room_ids, records) where records is a NumPy record
+        array with dictionary-encoded user/room codes, epoch seconds and flag
+        bits (hiding, speaking). Samples are streamed with a binary COPY
+        so there is no per-row Python object. Runs on its own connection so
+        the snapshot does not change the isolation of the shared one.
+        """
+        connection = self._open_connection()
+        try:
+            with connection, connection.cursor() as cursor:
+                # Codes and dictionaries must come from the same snapshot
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                
+                # Go through the lobby's users so the (user_id, lobby_id, recorded_at) index is used
+                cursor.execute("SELECT user_id FROM latest_location WHERE lobby_id = %s", (lobby_id,))
+                lobby_users = [row[0] for row in cursor.fetchall()]
+                if not lobby_users:
+                    return [], [], parse_binary_copy(b'')
+                
+                # Filter text and its parameters; every query substitutes them exactly once
+                sample_filter = """
+                    FROM location_history
+                    WHERE user_id = ANY(%s) AND lobby_id = %s
+                      AND (%s::timestamp IS NULL OR recorded_at >= %s)
+                      AND (%s::timestamp IS NULL OR recorded_at < %s)
+                """
+                filter_params = (lobby_users, lobby_id, since, since, until, until)
+                
+                cursor.execute(f"""
+                    SELECT COALESCE(array_agg(DISTINCT room_id ORDER BY room_id), '{{}}')
+                    {sample_filter}
+                """, filter_params)
+                room_ids = cursor.fetchone()[0]
+                user_ids = sorted(lobby_users)
+                
+                # Dictionary-encode against the (small) user and room lists with hash joins
+                buffer = io.BytesIO()
+                cursor.copy_expert(cursor.mogrify(f"""
+                    COPY (
+                        SELECT (u.code - 1)::int4, (r.code - 1)::int4,
+                               EXTRACT(EPOCH FROM s.recorded_at)::float8,
+                               ((CASE WHEN s.is_hiding THEN 1 ELSE 0 END)
+                                | (CASE WHEN s.is_speaking THEN 2 ELSE 0 END))::int2
+                        FROM (SELECT * {sample_filter}) s
+                        JOIN unnest(%s::text[]) WITH ORDINALITY AS u(user_id, code) ON u.user_id = s.user_id
+                        JOIN unnest(%s::text[]) WITH ORDINALITY AS r(room_id, code) ON r.room_id = s.room_id
+                    ) TO STDOUT WITH (FORMAT binary)
+                """, filter_params + (user_ids, room_ids)).decode(), buffer)
+                
+                records = parse_binary_copy(buffer.getvalue())
+                return user_ids, room_ids, records
+        finally:
+            connection.close()
+
+    def _select_dwell_runs(self, cursor, since: datetime, until: datetime, max_gap: timedelta,
+                           user_id: str = None, lobby_id: str = None):
+        """Collapse raw samples in [since, until) into runs of identical state (gaps-and-islands)"""
+        cursor.execute("""
+            WITH samples AS (
+                SELECT lobby_id, user_id, room_id, is_speaking, is_hiding, recorded_at,
+                       CASE WHEN LAG(recorded_at) OVER w IS NULL
+                              OR LAG(room_id) OVER w IS DISTINCT FROM room_id
+                              OR LAG(is_speaking) OVER w IS DISTINCT FROM is_speaking
+                              OR LAG(is_hiding) OVER w IS DISTINCT FROM is_hiding
+                              OR recorded_at - LAG(recorded_at) OVER w > %(max_gap)s
+                            THEN 1 ELSE 0 END AS run_start
+                FROM location_history
+                WHERE recorded_at >= %(since)s AND recorded_at < %(until)s
+                  AND (%(user_id)s::varchar IS NULL OR user_id = %(user_id)s)
+                  AND (%(lobby_id)s::varchar IS NULL OR lobby_id = %(lobby_id)s)
+                WINDOW w AS (PARTITION BY lobby_id, user_id ORDER BY recorded_at)
+            ), runs AS (
+                SELECT *, SUM(run_start) OVER (
+                    PARTITION BY lobby_id, user_id ORDER BY recorded_at ROWS UNBOUNDED PRECEDING
+                ) AS run
+                FROM samples
+            )
+            SELECT lobby_id, user_id, room_id, is_speaking, is_hiding,
+                   MIN(recorded_at) AS enter_at, MAX(recorded_at) AS leave_at, COUNT(*) AS sample_count
+            FROM runs
+            GROUP BY lobby_id, user_id, run, room_id, is_speaking, is_hiding
+            ORDER BY lobby_id, user_id, enter_at
+        """, {'since': since, 'until': until, 'max_gap': max_gap, 'user_id': user_id, 'lobby_id': lobby_id})
+        return [DwellInterval(**result) for result in cursor.fetchall()]
+
+    def _store_dwell_runs(self, cursor, runs, max_gap: timedelta) -> int:
+        """Store dwell runs, merging each user's first run into their last stored interval
+
+        Returns the number of new intervals inserted.
+        """
+        last = {}
+        if runs:
+            keys = list({(run.lobby_id, run.user_id) for run in runs})
+            rows = execute_values(cursor, """
+                SELECT d.id, v.lobby_id, v.user_id, d.room_id, d.is_speaking, d.is_hiding,
+                       d.enter_at, d.leave_at, d.sample_count
+                FROM (VALUES %s) AS v(lobby_id, user_id)
+                CROSS JOIN LATERAL (
+                    SELECT * FROM location_dwell
+                    WHERE user_id = v.user_id AND lobby_id = v.lobby_id
+                    ORDER BY enter_at DESC
+                    LIMIT 1
+                ) d
+            """, keys, page_size=len(keys), fetch=True)
+            last = {(row['lobby_id'], row['user_id']): DwellInterval(**row) for row in rows}
+        
+        extended = {}
+        inserted = []
+        for run in runs:
+            key = (run.lobby_id, run.user_id)
+            previous = last.get(key)
+            if previous is not None and previous.id is not None and previous.continued_by(run, max_gap):
+                previous.leave_at = run.leave_at
+                previous.sample_count += run.sample_count
+                extended[previous.id] = previous
+            else:
+                inserted.append(run)
+            # Only the first run of a key can continue a stored interval
+            last[key] = run
+        
+        if extended:
+            execute_values(cursor, """
+                UPDATE location_dwell d
+                SET leave_at = v.leave_at, sample_count = v.sample_count
+                FROM (VALUES %s) AS v(id, leave_at, sample_count)
+                WHERE d.id = v.id
+            """, [(d.id, d.leave_at, d.sample_count) for d in extended.values()], page_size=1000)
+        if inserted:
+            execute_values(cursor, """
+                INSERT INTO location_dwell
+                (lobby_id, user_id, room_id, is_speaking, is_hiding, enter_at, leave_at, sample_count)
+                VALUES %s
+            """, [(
+                d.lobby_id, d.user_id, d.room_id, d.is_speaking, d.is_hiding,
+                d.enter_at, d.leave_at, d.sample_count
+            ) for d in inserted], page_size=1000)
+        return len(inserted)
+
+    def get_compaction_watermark(self):
+        """Get the time up to which raw samples have been compacted into location_dwell"""
+        try:
+            with self.connection, self.connection.cursor() as cursor:
+                cursor.execute("SELECT compacted_until FROM location_compaction WHERE id = 1")
+                result = cursor.fetchone()
+                return result[0] if result else None
+                
+        except Exception as e:
+            raise e
+
+    def compact_locations(self, since: datetime, until: datetime, max_gap: timedelta):
+        """Compact raw samples in [since, until) into dwell intervals and advance the watermark
+
+        Runs that continue the last stored interval of a user are merged into it,
+        so a dwell is not split at compaction window boundaries.
+        """
+        try:
+            with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                # Samples being written wait for this step, see _mark_late_locations
+                cursor.execute("SELECT compacted_until FROM location_compaction WHERE id = 1 FOR UPDATE")
+                runs = self._select_dwell_runs(cursor, since, until, max_gap)
+                inserted = self._store_dwell_runs(cursor, runs, max_gap)
+                
+                cursor.execute("""
+                    INSERT INTO location_compaction (id, compacted_until) VALUES (1, %s)
+                    ON CONFLICT (id) DO UPDATE SET compacted_until = EXCLUDED.compacted_until
+                """, (until,))
+                self.connection.commit()
+                return len(runs), inserted
+                
+        except Exception as e:
+            self.connection.rollback()
+            raise e
+
+    def get_recompactions(self):
+        """Get the (lobby_id, user_id, since) of users with late samples below the watermark"""
+        try:
+            with self.connection, self.connection.cursor() as cursor:
+                cursor.execute("SELECT lobby_id, user_id, since FROM location_recompaction")
+                return cursor.fetchall()
+                
+        except Exception as e:
+            raise e
+
+    def recompact_locations(self, lobby_id: str, user_id: str, max_gap: timedelta, floor: datetime):
+        """Compact a user's raw samples again from their earliest late sample up to the watermark
+
+        The interval the late sample falls into (or could continue) is rebuilt
+        from its start, unless that lies before floor, the start of the oldest
+        raw partition, in which case it is kept and the runs are merged into it.
+        """
+        try:
+            with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("SELECT compacted_until FROM location_compaction WHERE id = 1 FOR UPDATE")
+                watermark = cursor.fetchone()['compacted_until']
+                cursor.execute("""
+                    DELETE FROM location_recompaction
+                    WHERE lobby_id = %s AND user_id = %s
+                    RETURNING since
+                """, (lobby_id, user_id))
+                result = cursor.fetchone()
+                if result is None:
+                    self.connection.commit()
+                    return 0, 0
+                since = result['since']
+                
+                cursor.execute("""
+                    SELECT enter_at FROM location_dwell
+                    WHERE user_id = %s AND lobby_id = %s AND enter_at <= %s AND leave_at >= %s
+                    ORDER BY enter_at DESC
+                    LIMIT 1
+                """, (user_id, lobby_id, since, since - max_gap))
+                result = cursor.fetchone()
+                if result is not None and result['enter_at'] >= floor:
+                    since = result['enter_at']
+                
+                cursor.execute("""
+                    DELETE FROM location_dwell
+                    WHERE user_id = %s AND lobby_id = %s AND enter_at >= %s
+                """, (user_id, lobby_id, since))
+                runs = self._select_dwell_runs(cursor, since, watermark, max_gap, user_id=user_id, lobby_id=lobby_id)
+                inserted = self._store_dwell_runs(cursor, runs, max_gap)
+                self.connection.commit()
+                return len(runs), inserted
+                
+        except Exception as e:
+            self.connection.rollback()
+            raise e
+
+    def get_dwell_history(self, user_id: str, lobby_id: str, limit: int = 10, max_gap: timedelta = None,
+                          since: datetime = None, until: datetime = None):
+        """Get a user's dwell intervals, newest first
+
+        Compacted intervals come from location_dwell; samples newer than the
+        compaction watermark are collapsed on the fly from the raw window. The
+        watermark is read in the same statement as the intervals, so a
+        compaction committing in between cannot return a window twice.
+        """
+        try:
+            with self.connection, self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    SELECT w.watermark, d.*
+                    FROM (SELECT MAX(compacted_until) AS watermark FROM location_compaction) w
+                    LEFT JOIN LATERAL (
+                        SELECT id, lobby_id, user_id, room_id, is_speaking, is_hiding,
+                               enter_at, leave_at, sample_count
+                        FROM location_dwell
+                        WHERE user_id = %s AND lobby_id = %s
+                          AND (%s::timestamp IS NULL OR leave_at >= %s)
+                          AND (%s::timestamp IS NULL OR enter_at < %s)
+                        ORDER BY enter_at DESC
+                        LIMIT %s
+                    ) d ON TRUE
+                    ORDER BY d.enter_at DESC
+                """, (user_id, lobby_id, since, since, until, until, limit))
+                rows = cursor.fetchall()
+                watermark = rows[0]['watermark'] or datetime.min
+                compacted = [
+                    DwellInterval(**{key: value for key, value in row.items() if key != 'watermark'})
+                    for row in rows if row['id'] is not None
+                ]
+                
+                # Raw tail that has not been compacted yet
+                tail = []
+                if until is None or until > watermark:
+                    tail = self._select_dwell_runs(
+                        cursor, max(watermark, since or datetime.min), until or datetime.max,
+                        max_gap, user_id=user_id, lobby_id=lobby_id
+                    )
+                
+                if tail and compacted and compacted[0].continued_by(tail[0], max_gap):
+                    compacted[0].leave_at = tail[0].leave_at
+                    compacted[0].sample_count += tail[0].sample_count
+                    tail = tail[1:]
+                
+                return (tail[::-1] + compacted)[:limit]
+                
+        except Exception as e:
+            raise e
+
     def close(self):
         """Close database connection"""
         if self.connection:
@@ -0,0 +1,221 @@
+import threading
+import time
+import os
+from collections import deque
+import psycopg2
+
+class IngestQueueFull(Exception):
+    """Raised when the ingest queue cannot take more samples"""
+
+    def __init__(self, retry_after: int):
+        super().__init__('Ingest queue is full')
+        self.retry_after = retry_after
+
+class IngestTimeout(Exception):
+    """Raised when a durable submit is not flushed in time"""
+
+class FlushTicket:
+    """Lets a durable submitter wait until its samples are committed"""
+
+    def __init__(self, count: int):
+        self.event = threading.Event()
+        self.pending = count  # samples not flushed yet, only touched by the flusher
+        self.error = None
+
+    def wait(self, timeout: float):
+        if not self.event.wait(timeout):
+            raise IngestTimeout('Timed out waiting for samples to be committed')
+        if self.error:
+            raise self.error
+
+class IngestBuffer:
+    """Write-behind buffer for location samples.
+
+    Samples are acknowledged once enqueued and written by a background flusher
+    in group commits, triggered when a full batch is waiting or the oldest
+    queued sample has waited for the flush interval. The queue is bounded;
+    when it is full, submitters get IngestQueueFull so callers can shed load.
+
+    A batch the database rejects for its data (rather than a connection
+    problem) is split in halves until the offending samples are isolated, so
+    only those are dropped.
+    """
+
+    def __init__(self, db, partitions=None):
+        self.db = db
+        self.partitions = partitions
+        self.capacity = int(os.getenv('INGEST_QUEUE_SIZE', '50000'))
+        self.batch_size = int(os.getenv('INGEST_BATCH_SIZE', '1000'))
+        self.flush_interval = float(os.getenv('INGEST_FLUSH_INTERVAL', '0.05'))
+        self.durable_timeout = float(os.getenv('INGEST_DURABLE_TIMEOUT', '5'))
+        self.max_retries = int(os.getenv('INGEST_MAX_RETRIES', '3'))
+
+        self.queue = deque()  # (sample, ticket or None)
+        self.cond = threading.Condition()
+        self.oldest_at = None
+        self.running = False
+        self.thread = None
+
+        self.enqueued = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.dropped = 0
+        self.rejected_full = 0
+        self.last_flush_size = 0
+        self.last_flush_ms = 0.0
+
+    def submit(self, samples, durable: bool = False):
+        """Enqueue samples; with durable=True, block until they are committed"""
+        ticket = FlushTicket(len(samples)) if durable else None
+        with self.cond:
+            if len(self.queue) + len(samples) > self.capacity:
+                self.rejected_full += len(samples)
+                raise IngestQueueFull(self.retry_after())
+            if not self.queue:
+                self.oldest_at = time.monotonic()
+            self.queue.extend((sample, ticket) for sample in samples)
+            self.enqueued += len(samples)
+            self.cond.notify()
+
+        if ticket:
+            ticket.wait(self.durable_timeout)
+
+    def retry_after(self) -> int:
+        """Seconds a rejected client should wait, based on how long a full queue takes to drain"""
+        if self.last_flush_size and self.last_flush_ms:
+            drain_seconds = len(self.queue) / self.last_flush_size * max(self.last_flush_ms / 1000, self.flush_interval)
+            return max(1, int(drain_seconds + 0.999))
+        return 1
+
+    def metrics(self) -> dict:
+        with self.cond:
+            return {
+                'queueDepth': len(self.queue),
+                'queueCapacity': self.capacity,
+                'batchSize': self.batch_size,
+                'flushIntervalMs': self.flush_interval * 1000,
+                'enqueued': self.enqueued,
+                'flushed': self.flushed,
+                'flushes': self.flushes,
+                'failedFlushes': self.failed_flushes,
+                'dropped': self.dropped,
+                'rejectedFull': self.rejected_full,
+                'lastFlushSize': self.last_flush_size,
+                'lastFlushMs': round(self.last_flush_ms, 3)
+            }
+
+    def _next_batch(self):
+        """Wait for a size or interval trigger and take the next batch off the queue"""
+        with self.cond:
+            while self.running and len(self.queue) < self.batch_size:
+                if self.queue:
+                    remaining = self.oldest_at + self.flush_interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                else:
+                    self.cond.wait()
+            count = min(self.batch_size, len(self.queue))
+            batch = [self.queue.popleft() for _ in range(count)]
+            self.oldest_at = time.monotonic() if self.queue else None
+            return batch
+
+    def _write(self, samples):
+        if self.partitions:
+            self.partitions.ensure_for(samples)
+        self.db.track_locations(samples)
+
+    def _bisect(self, batch):
+        """Write a rejected batch in halves; returns the (entry, error) pairs that still fail"""
+        if len(batch) == 1:
+            return [(batch[0], None)]
+        failed = []
+        middle = len(batch) // 2
+        for half in (batch[:middle], batch[middle:]):
+            try:
+                self._write([sample for sample, _ in half])
+            except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+                failed.extend((entry, error or e) for entry, error in self._bisect(half))
+            except Exception as e:
+                failed.extend((entry, e) for entry in half)
+        return failed
+
+    def _flush(self, batch):
+        samples = [sample for sample, _ in batch]
+        error = None
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                self._write(samples)
+                error = None
+                break
+            except Exception as e:
+                error = e
+                with self.cond:
+                    self.failed_flushes += 1
+                print(f"❌ Location flush failed (attempt {attempt + 1}): {e}")
+                # Retrying does not help samples the database rejects
+                if isinstance(e, (psycopg2.DataError, psycopg2.IntegrityError)):
+                    break
+                if attempt < self.max_retries:
+                    time.sleep(min(2 ** attempt * 0.1, 2))
+
+        if error is None:
+            failed = []
+        elif isinstance(error, (psycopg2.DataError, psycopg2.IntegrityError)):
+            failed = [(entry, e or error) for entry, e in self._bisect(batch)]
+            for (sample, _), e in failed:
+                print(f"❌ Dropped location sample of {sample.user_id} in {sample.lobby_id}: {e}")
+        else:
+            failed = [(entry, error) for entry in batch]
+
+        with self.cond:
+            self.dropped += len(failed)
+            self.flushed += len(batch) - len(failed)
+            if error is None:
+                self.flushes += 1
+                self.last_flush_size = len(samples)
+                self.last_flush_ms = (time.perf_counter() - started) * 1000
+
+        # A submit can span several batches, it is done once all of them are
+        tickets = {}  # id -> (ticket, samples of it in this batch)
+        for _, ticket in batch:
+            if ticket:
+                tickets[id(ticket)] = (ticket, tickets.get(id(ticket), (ticket, 0))[1] + 1)
+        for (_, ticket), e in failed:
+            if ticket:
+                ticket.error = e
+        for ticket, count in tickets.values():
+            ticket.pending -= count
+            if ticket.error or ticket.pending == 0:
+                ticket.event.set()
+
+    def run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                try:
+                    self._flush(batch)
+                except Exception as e:
+                    # Keep the only flusher alive; waiting durable submitters get the error
+                    print(f"❌ Location flush bookkeeping failed: {e}")
+                    for _, ticket in batch:
+                        if ticket:
+                            ticket.error = e
+                            ticket.event.set()
+            elif not self.running:
+                return
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='location-ingest', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop accepting the interval trigger and drain what is queued"""
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread:
+            self.thread.join()
@@ -0,0 +1,121 @@
+import threading
+import time
+import os
+from collections import OrderedDict, deque
+import requests
+
+class MapGraph:
+    """Room adjacency of one map version, with hop distances from every room.
+
+    Connections are treated as two-way. rings[room][d] lists the rooms exactly
+    d hops away, so a k-hop query only visits the rooms within k.
+    """
+
+    def __init__(self, map_id: str, version: str, rooms, connections):
+        self.map_id = map_id
+        self.version = version
+        neighbours = {room: set() for room in rooms}
+        for from_room, to_room in connections:
+            neighbours.setdefault(from_room, set()).add(to_room)
+            neighbours.setdefault(to_room, set()).add(from_room)
+
+        self.rings = {}
+        for source in neighbours:
+            rings = [[source]]
+            seen = {source}
+            frontier = deque([source])
+            while frontier:
+                next_ring = []
+                for _ in range(len(frontier)):
+                    for neighbour in neighbours[frontier.popleft()]:
+                        if neighbour not in seen:
+                            seen.add(neighbour)
+                            next_ring.append(neighbour)
+                            frontier.append(neighbour)
+                if next_ring:
+                    rings.append(next_ring)
+            self.rings[source] = rings
+
+    def within(self, room_id: str, k: int):
+        """Yield (room_id, hops) for rooms at most k hops away, nearest first"""
+        # A room unknown to the map only neighbours itself
+        for hops, ring in enumerate(self.rings.get(room_id, [[room_id]])[:k + 1]):
+            for room in ring:
+                yield room, hops
+
+class MapCache:
+    """Caches each lobby's map graph, pulled from the Lobby and Map services.
+
+    A lobby's map id is looked up once. Cached maps are revalidated with a
+    conditional GET (ETag = map version) at most every refresh interval, and
+    rebuilt only when the version changed. If the Map service cannot be
+    reached, the cached version keeps being used.
+    """
+
+    def __init__(self):
+        self.lobby_service_url = os.getenv('LOBBY_SERVICE_URL', 'http://localhost:3005')
+        self.map_service_url = os.getenv('MAP_SERVICE_URL', 'http://localhost:3006')
+        self.refresh_interval = float(os.getenv('LOCATION_MAP_REFRESH_SECONDS', '30'))
+        self.request_timeout = float(os.getenv('SERVICE_REQUEST_TIMEOUT', '2'))
+        self.max_lobbies = int(os.getenv('LOCATION_MAP_CACHE_LOBBIES', '10000'))
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.lobby_maps = OrderedDict()  # lobby_id -> map_id, least recently used first
+        self.graphs = {}  # map_id -> (MapGraph, monotonic time of last validation)
+
+    def _get_map_id(self, lobby_id: str):
+        with self.lock:
+            map_id = self.lobby_maps.get(lobby_id)
+            if map_id is not None:
+                self.lobby_maps.move_to_end(lobby_id)
+                return map_id
+
+        response = self.session.get(f'{self.lobby_service_url}/lobbies/{lobby_id}', timeout=self.request_timeout)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        map_id = response.json()['mapId']
+
+        with self.lock:
+            self.lobby_maps[lobby_id] = map_id
+            while len(self.lobby_maps) > self.max_lobbies:
+                self.lobby_maps.popitem(last=False)
+        return map_id
+
+    def _get_graph(self, map_id: str):
+        with self.lock:
+            cached = self.graphs.get(map_id)
+        if cached and time.monotonic() - cached[1] < self.refresh_interval:
+            return cached[0]
+
+        headers = {'If-None-Match': f'"{cached[0].version}"'} if cached else {}
+        try:
+            response = self.session.get(f'{self.map_service_url}/maps/{map_id}',
+                                        headers=headers, timeout=self.request_timeout)
+            if response.status_code == 404:
+                return None
+            if response.status_code == 304:
+                graph = cached[0]
+            else:
+                response.raise_for_status()
+                data = response.json()
+                graph = MapGraph(
+                    map_id,
+                    str(data['version']),
+                    [room['id'] for room in data['rooms']],
+                    [(connection['from'], connection['to']) for connection in data['connections']]
+                )
+        except requests.RequestException as e:
+            if not cached:
+                raise
+            print(f"❌ Map {map_id} revalidation failed, using version {cached[0].version}: {e}")
+            graph = cached[0]
+
+        with self.lock:
+            self.graphs[map_id] = (graph, time.monotonic())
+        return graph
+
+    def get_lobby_graph(self, lobby_id: str):
+        """Get the map graph of a lobby, or None if the lobby or its map does not exist"""
+        map_id = self._get_map_id(lobby_id)
+        return self._get_graph(map_id) if map_id else None
@@ -1,17 +1,16 @@
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, field
 from typing import List, Optional, Dict, Any
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 
-@dataclass
+@dataclass(slots=True)
 class LocationSample:
     user_id: str
     lobby_id: str
     room_id: str
     is_speaking: bool
-    group: List[str]
     is_hiding: bool
-    at: str
+    at: datetime
 
 @dataclass
 class TrackLocationRequest:
@@ -31,6 +30,7 @@ class TrackLocationRequest:
 class LatestLocationResponse:
     room_id: str
     is_alone: bool
+    group: List[str]
     last_seen_at: str
 
 @dataclass
@@ -42,4 +42,59 @@ class LocationHistory:
     group: List[str]
     is_hiding: bool
     recorded_at: str
-    created_at: str
\ No newline at end of file
+    created_at: str
+
+@dataclass(slots=True)
+class LatestLocation:
+    lobby_id: str
+    user_id: str
+    room_id: str
+    is_speaking: bool
+    is_hiding: bool
+    at: datetime
+    group: List[str] = field(default_factory=list)  # co-located users, filled in by LocationState
+    
+    @property
+    def is_alone(self) -> bool:
+        # Alone when the group is empty or only contains the user themselves
+        return len(self.group) == 0 or (len(self.group) == 1 and self.group[0] == self.user_id)
+    
+    def same_state(self, sample) -> bool:
+        """Whether the sample reports the same room and speaking/hiding state"""
+        return (
+            self.room_id == sample.room_id
+            and self.is_speaking == sample.is_speaking
+            and self.is_hiding == sample.is_hiding
+        )
+    
+    @classmethod
+    def from_sample(cls, sample: LocationSample):
+        return cls(
+            lobby_id=sample.lobby_id,
+            user_id=sample.user_id,
+            room_id=sample.room_id,
+            is_speaking=sample.is_speaking,
+            is_hiding=sample.is_hiding,
+            at=sample.at
+        )
+
+@dataclass
+class DwellInterval:
+    lobby_id: str
+    user_id: str
+    room_id: str
+    is_speaking: bool
+    is_hiding: bool
+    enter_at: datetime
+    leave_at: datetime
+    sample_count: int
+    id: Optional[int] = None
+    
+    def continued_by(self, other, max_gap) -> bool:
+        """Whether other (starting later) is the same dwell, split only by a compaction boundary"""
+        return (
+            self.room_id == other.room_id
+            and self.is_speaking == other.is_speaking
+            and self.is_hiding == other.is_hiding
+            and timedelta(0) <= other.enter_at - self.leave_at <= max_gap
+        )
@@ -0,0 +1,92 @@
+import threading
+import os
+from datetime import datetime, timedelta
+
+class PartitionManager:
+    """Keeps the daily partitions of location_history in shape.
+
+    Partitions are pre-created a few days ahead and on demand for samples that
+    fall outside them, and partitions older than the retention window are
+    dropped (or detached, to be archived by an operator). Raw samples are only
+    kept for a short window since history is served from compacted dwell
+    intervals; partitions that have not been compacted yet are never expired.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.retention_days = int(os.getenv('LOCATION_RETENTION_DAYS', '3'))
+        self.premake_days = int(os.getenv('LOCATION_PARTITION_PREMAKE_DAYS', '3'))
+        self.detach_expired = os.getenv('LOCATION_RETENTION_MODE', 'drop') == 'detach'
+        self.maintenance_interval = float(os.getenv('LOCATION_PARTITION_MAINTENANCE_INTERVAL', '3600'))
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.days = set()
+
+    def ensure(self, days):
+        """Make sure partitions exist for all of the given dates"""
+        missing = set(days) - self.days
+        if not missing:
+            return
+        with self.lock:
+            missing = set(days) - self.days
+            if missing:
+                self.db.create_partitions(missing)
+                self.days |= missing
+
+    def check(self, sample):
+        """Raise ValueError for a sample outside the days partitions are kept for.
+
+        Older days may already be expired (a detached partition still blocks
+        recreating it), and far-future ones would create partitions on demand.
+        """
+        today = datetime.utcnow().date()
+        day = sample.at.date()
+        if day < today - timedelta(days=self.retention_days):
+            raise ValueError(f'at is older than the {self.retention_days}-day retention window')
+        if day > today + timedelta(days=self.premake_days):
+            raise ValueError(f'at is more than {self.premake_days} days in the future')
+
+    def ensure_for(self, samples):
+        self.ensure({sample.at.date() for sample in samples})
+
+    def maintain(self):
+        """Pre-create upcoming partitions and expire ones past the retention window"""
+        today = datetime.utcnow().date()
+        with self.lock:
+            self.days = set(self.db.get_partitions())
+            upcoming = {today + timedelta(days=i) for i in range(self.premake_days + 1)}
+            if upcoming - self.days:
+                self.db.create_partitions(upcoming - self.days)
+                self.days |= upcoming
+
+            cutoff = today - timedelta(days=self.retention_days)
+            watermark = self.db.get_compaction_watermark()
+            if watermark is None:
+                return
+            # A partition [day, day + 1) is fully compacted once day + 1 <= watermark
+            cutoff = min(cutoff, watermark.date())
+            # and still needed while late samples in it wait to be recompacted
+            for _, _, since in self.db.get_recompactions():
+                cutoff = min(cutoff, since.date())
+            for day in sorted(d for d in self.days if d < cutoff):
+                self.db.expire_partition(day, detach=self.detach_expired)
+                self.days.discard(day)
+                print(f"✅ {'Detached' if self.detach_expired else 'Dropped'} location_history partition for {day}")
+
+    def run(self):
+        while not self.stopped.wait(self.maintenance_interval):
+            try:
+                self.maintain()
+            except Exception as e:
+                print(f"❌ Partition maintenance failed: {e}")
+
+    def start(self):
+        self.maintain()
+        self.thread = threading.Thread(target=self.run, name='location-partitions', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
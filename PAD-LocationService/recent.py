@@ -0,0 +1,193 @@
+import threading
+import time
+import os
+from array import array
+from datetime import datetime, timedelta
+import numpy as np
+from models import LocationHistory
+from analytics import FLAG_HIDING, FLAG_SPEAKING
+
+EPOCH = datetime(1970, 1, 1)
+
+def to_micros(at: datetime) -> int:
+    return (at - EPOCH) // timedelta(microseconds=1)
+
+def from_micros(micros: int) -> datetime:
+    return EPOCH + timedelta(microseconds=micros)
+
+class LobbySamples:
+    """Recent samples of one lobby as parallel typed arrays.
+
+    User and room ids are interned per lobby, so a sample costs 4 + 4 bytes
+    of codes, 8 + 8 of timestamps and 1 of flags. The few older samples that
+    were stored with a client-sent group keep it on the side, keyed by user
+    code and timestamp, so history reads match the database.
+    """
+
+    def __init__(self):
+        self.user_ids, self.user_codes = [], {}
+        self.room_ids, self.room_codes = [], {}
+        self.users = array('I')
+        self.rooms = array('I')
+        self.ts = array('q')  # recorded_at, microseconds since the epoch
+        self.created = array('q')  # when the sample was accepted
+        self.flags = array('B')
+        self.groups = {}  # (user code, ts) -> stored group, only for samples that have one
+
+    def columns(self):
+        return (self.users, self.rooms, self.ts, self.created, self.flags)
+
+    def _intern(self, codes: dict, values: list, value) -> int:
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(values)
+            values.append(value)
+        return code
+
+    def append(self, sample, created_micros: int, group=None):
+        user_code = self._intern(self.user_codes, self.user_ids, sample.user_id)
+        ts = to_micros(sample.at)
+        if group:
+            self.groups[(user_code, ts)] = group
+        self.users.append(user_code)
+        self.rooms.append(self._intern(self.room_codes, self.room_ids, sample.room_id))
+        self.ts.append(ts)
+        self.created.append(created_micros)
+        self.flags.append(
+            (FLAG_HIDING if sample.is_hiding else 0)
+            | (FLAG_SPEAKING if sample.is_speaking else 0)
+        )
+
+    def trim(self, cutoff_micros: int):
+        """Drop the leading samples recorded before the cutoff"""
+        ts = np.frombuffer(self.ts, dtype=np.int64)
+        keep = ts >= cutoff_micros
+        count = int(np.argmax(keep)) if keep.any() else len(ts)
+        del ts, keep  # release the buffer so the arrays can be resized
+        if count:
+            for column in self.columns():
+                del column[:count]
+        if self.groups:
+            self.groups = {key: group for key, group in self.groups.items() if key[1] >= cutoff_micros}
+
+    def select(self, since_micros, until_micros, user_code=None) -> np.ndarray:
+        """Indices of samples in [since, until), optionally for one user"""
+        ts = np.frombuffer(self.ts, dtype=np.int64)
+        mask = np.ones(len(ts), dtype=bool)
+        if since_micros is not None:
+            mask &= ts >= since_micros
+        if until_micros is not None:
+            mask &= ts < until_micros
+        if user_code is not None:
+            mask &= np.frombuffer(self.users, dtype=np.uint32) == user_code
+        return np.flatnonzero(mask)
+
+class RecentSamples:
+    """In-memory store of the last few hours of persisted samples, per lobby.
+
+    Covers every sample recorded at or after `since`: the store is warmed from
+    location_history at startup and then fed with every sample handed to the
+    ingest queue. Reads whose range starts within the coverage are answered
+    from memory with vectorized scans; anything older goes to the database.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lobbies = {}  # lobby_id -> LobbySamples
+        self.window = timedelta(seconds=float(os.getenv('LOCATION_RECENT_WINDOW_SECONDS', '21600')))
+        self.since = datetime.max  # nothing is covered until warmed
+        self.last_trim = time.monotonic()
+
+    def _lobby(self, lobby_id: str) -> LobbySamples:
+        lobby = self.lobbies.get(lobby_id)
+        if lobby is None:
+            lobby = self.lobbies[lobby_id] = LobbySamples()
+        return lobby
+
+    def _trim(self):
+        cutoff = datetime.utcnow() - self.window
+        cutoff_micros = to_micros(cutoff)
+        for lobby_id, lobby in list(self.lobbies.items()):
+            lobby.trim(cutoff_micros)
+            if not lobby.ts:
+                del self.lobbies[lobby_id]
+        self.since = max(self.since, cutoff)
+
+    def append(self, samples):
+        """Add samples that are being persisted"""
+        created_micros = to_micros(datetime.utcnow())
+        with self.lock:
+            if time.monotonic() - self.last_trim > 60:
+                self._trim()
+                self.last_trim = time.monotonic()
+            for sample in samples:
+                self._lobby(sample.lobby_id).append(sample, created_micros)
+
+    def warm(self, persisted, since: datetime):
+        """Load (sample, created_at, group) rows persisted since the given time and start covering it"""
+        with self.lock:
+            for sample, created_at, group in persisted:
+                self._lobby(sample.lobby_id).append(sample, to_micros(created_at), group)
+            self.since = since
+
+    def covers(self, since: datetime) -> bool:
+        return since is not None and since >= self.since
+
+    def get_user_history(self, user_id: str, lobby_id: str, limit: int,
+                         since: datetime = None, until: datetime = None):
+        """Latest samples of a user, newest first, or None if older ones may be needed"""
+        since_micros = to_micros(since) if since is not None else None
+        until_micros = to_micros(until) if until is not None else None
+        with self.lock:
+            lobby = self.lobbies.get(lobby_id)
+            user_code = lobby.user_codes.get(user_id) if lobby else None
+            if user_code is None:
+                return [] if self.covers(since) else None
+
+            # Without a covered lower bound, the newest samples must all lie in the coverage
+            lower = since_micros if self.covers(since) else to_micros(self.since)
+            indices = lobby.select(lower, until_micros, user_code)
+            if not self.covers(since) and len(indices) < limit:
+                return None
+            ts = np.frombuffer(lobby.ts, dtype=np.int64)
+            indices = indices[np.argsort(-ts[indices], kind='stable')[:limit]]
+            del ts
+
+            return [LocationHistory(
+                user_id=user_id,
+                lobby_id=lobby_id,
+                room_id=lobby.room_ids[lobby.rooms[i]],
+                is_speaking=bool(lobby.flags[i] & FLAG_SPEAKING),
+                group=lobby.groups.get((user_code, lobby.ts[i]), []),
+                is_hiding=bool(lobby.flags[i] & FLAG_HIDING),
+                recorded_at=from_micros(lobby.ts[i]).isoformat() + "Z",
+                created_at=from_micros(lobby.created[i]).isoformat() + "Z"
+            ) for i in indices.tolist()]
+
+    def get_lobby_columns(self, lobby_id: str, since: datetime, until: datetime = None):
+        """Copy out (user_ids, room_ids, user codes, room codes, epoch seconds, flags) for analytics"""
+        with self.lock:
+            lobby = self.lobbies.get(lobby_id)
+            if lobby is None:
+                return [], [], np.zeros(0, np.uint32), np.zeros(0, np.uint32), np.zeros(0), np.zeros(0, np.uint8)
+            indices = lobby.select(to_micros(since), to_micros(until) if until is not None else None)
+            return (
+                list(lobby.user_ids),
+                list(lobby.room_ids),
+                np.frombuffer(lobby.users, dtype=np.uint32)[indices],
+                np.frombuffer(lobby.rooms, dtype=np.uint32)[indices],
+                np.frombuffer(lobby.ts, dtype=np.int64)[indices] / 1e6,
+                np.frombuffer(lobby.flags, dtype=np.uint8)[indices]
+            )
+
+    def metrics(self) -> dict:
+        with self.lock:
+            count = sum(len(lobby.ts) for lobby in self.lobbies.values())
+            size = sum(column.itemsize * len(column)
+                       for lobby in self.lobbies.values() for column in lobby.columns())
+            return {
+                'recentLobbies': len(self.lobbies),
+                'recentSamples': count,
+                'recentBytes': size,
+                'recentSince': self.since.isoformat() + "Z" if self.since != datetime.max else None
+            }
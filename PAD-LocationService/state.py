@@ -0,0 +1,217 @@
+import threading
+import time
+import os
+from dataclasses import replace
+from datetime import datetime, timedelta
+from models import LatestLocation
+
+class LobbyState:
+    """Latest location per user for one lobby, plus who is in which room"""
+
+    def __init__(self):
+        self.users = {}  # user_id -> LatestLocation
+        self.rooms = {}  # room_id -> set of user_ids
+        self.written = {}  # user_id -> LatestLocation last persisted for the user
+        self.confirmed = set()  # users whose entry has been merged with the persisted row
+        self.loaded = False  # True once merged with everything persisted for the lobby
+        self.last_at = datetime.min
+
+class LocationState:
+    """In-memory latest location per (lobby, user), fronting the latest_location table.
+
+    Every accepted sample is applied here. An entry created from a sample alone
+    may still be older than what was persisted before this process started, so
+    it only counts once confirmed against the database (per user, or for the
+    whole lobby via load_lobby). Confirmed entries are never older than the
+    persisted row, so reads of them need no database access.
+
+    Samples that repeat the user's last persisted state within the heartbeat
+    interval are suppressed: they only refresh the in-memory entry (and so
+    last-seen time) and are not written. A changed state, or the same state
+    after the heartbeat, is written as usual.
+
+    Room membership is maintained incrementally as users move, so occupancy
+    reads never touch the database. A user's group is everyone present in the
+    same room (the user included), attached to entries as they are read.
+    Lobbies without samples for a while are evicted and fall back to the
+    database on their next read.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lobbies = {}  # lobby_id -> LobbyState
+        self.presence_timeout = timedelta(seconds=float(os.getenv('LOCATION_PRESENCE_TIMEOUT', '60')))
+        self.idle_timeout = timedelta(seconds=float(os.getenv('LOCATION_STATE_IDLE_TIMEOUT', '3600')))
+        # Keep below LOCATION_DWELL_MAX_GAP so suppressed stretches still compact into one dwell
+        self.heartbeat = timedelta(seconds=float(os.getenv('LOCATION_HEARTBEAT_SECONDS', '30')))
+        self.suppressed = 0
+        self.last_eviction = time.monotonic()
+
+    def _lobby(self, lobby_id: str) -> LobbyState:
+        lobby = self.lobbies.get(lobby_id)
+        if lobby is None:
+            lobby = self.lobbies[lobby_id] = LobbyState()
+        return lobby
+
+    def _apply(self, lobby: LobbyState, latest: LatestLocation) -> bool:
+        current = lobby.users.get(latest.user_id)
+        # Ignore samples that arrive out of order
+        if current is not None and current.at > latest.at:
+            return False
+        lobby.users[latest.user_id] = latest
+        lobby.last_at = max(lobby.last_at, latest.at)
+
+        if current is None or current.room_id != latest.room_id:
+            if current is not None:
+                members = lobby.rooms[current.room_id]
+                members.discard(latest.user_id)
+                if not members:
+                    del lobby.rooms[current.room_id]
+            lobby.rooms.setdefault(latest.room_id, set()).add(latest.user_id)
+        return True
+
+    def _mark_written(self, lobby: LobbyState, latest: LatestLocation):
+        written = lobby.written.get(latest.user_id)
+        if written is None or written.at <= latest.at:
+            lobby.written[latest.user_id] = latest
+
+    def _with_group(self, lobby: LobbyState, latest: LatestLocation, present_since: datetime) -> LatestLocation:
+        group = [user_id for user_id in lobby.rooms.get(latest.room_id, ())
+                 if user_id != latest.user_id and lobby.users[user_id].at >= present_since]
+        return replace(latest, group=sorted(group + [latest.user_id]))
+
+    def _evict_idle(self):
+        cutoff = datetime.utcnow() - self.idle_timeout
+        for lobby_id in [lobby_id for lobby_id, lobby in self.lobbies.items() if lobby.last_at < cutoff]:
+            del self.lobbies[lobby_id]
+
+    def select_changed(self, samples) -> list:
+        """Pick the samples that have to be persisted, counting the rest as suppressed.
+
+        A sample is suppressed when it repeats the last persisted state of its
+        user (including earlier samples of the same batch) less than a
+        heartbeat after it. Out-of-order samples are always persisted.
+        """
+        with self.lock:
+            pending = {}  # (lobby_id, user_id) -> sample selected earlier in this batch
+            changed = []
+            for sample in samples:
+                key = (sample.lobby_id, sample.user_id)
+                written = pending.get(key)
+                if written is None:
+                    lobby = self.lobbies.get(sample.lobby_id)
+                    written = lobby.written.get(sample.user_id) if lobby else None
+                if (written is None or not written.same_state(sample)
+                        or not timedelta(0) <= sample.at - written.at < self.heartbeat):
+                    changed.append(sample)
+                    pending[key] = LatestLocation.from_sample(sample)
+            self.suppressed += len(samples) - len(changed)
+            return changed
+
+    def apply(self, latest: LatestLocation, written: bool = True) -> bool:
+        """Record a newer location for the user; returns False if it was out of order
+
+        written tells whether the sample is being persisted or was suppressed.
+        """
+        with self.lock:
+            if time.monotonic() - self.last_eviction > 60:
+                self._evict_idle()
+                self.last_eviction = time.monotonic()
+            lobby = self._lobby(latest.lobby_id)
+            if written:
+                self._mark_written(lobby, latest)
+            return self._apply(lobby, latest)
+
+    def warm(self, persisted):
+        """Seed the state with recently active users, e.g. at startup"""
+        with self.lock:
+            for latest in persisted:
+                lobby = self._lobby(latest.lobby_id)
+                self._apply(lobby, latest)
+                self._mark_written(lobby, latest)
+                lobby.confirmed.add(latest.user_id)
+
+    def get_user(self, lobby_id: str, user_id: str):
+        """Get the user's latest location, or None if it is not known to be current"""
+        present_since = datetime.utcnow() - self.presence_timeout
+        with self.lock:
+            lobby = self.lobbies.get(lobby_id)
+            if lobby is None or not (lobby.loaded or user_id in lobby.confirmed):
+                return None
+            latest = lobby.users.get(user_id)
+            return self._with_group(lobby, latest, present_since) if latest else None
+
+    def confirm_user(self, lobby_id: str, user_id: str, persisted):
+        """Merge the user's persisted latest location (or None) and mark the entry current"""
+        present_since = datetime.utcnow() - self.presence_timeout
+        with self.lock:
+            lobby = self._lobby(lobby_id)
+            if persisted is not None:
+                self._apply(lobby, persisted)
+                self._mark_written(lobby, persisted)
+            lobby.confirmed.add(user_id)
+            latest = lobby.users.get(user_id)
+            return self._with_group(lobby, latest, present_since) if latest else None
+
+    def get_lobby(self, lobby_id: str):
+        """Get latest locations of all users in a lobby, or None if the lobby is not loaded"""
+        present_since = datetime.utcnow() - self.presence_timeout
+        with self.lock:
+            lobby = self.lobbies.get(lobby_id)
+            if lobby is None or not lobby.loaded:
+                return None
+            return [self._with_group(lobby, latest, present_since) for latest in lobby.users.values()]
+
+    def get_lobbies(self, lobby_ids) -> dict:
+        """Get latest locations for several lobbies; lobbies that are not loaded map to None"""
+        present_since = datetime.utcnow() - self.presence_timeout
+        with self.lock:
+            snapshot = {}
+            for lobby_id in lobby_ids:
+                lobby = self.lobbies.get(lobby_id)
+                snapshot[lobby_id] = [
+                    self._with_group(lobby, latest, present_since) for latest in lobby.users.values()
+                ] if lobby is not None and lobby.loaded else None
+            return snapshot
+
+    def get_active_lobby_ids(self) -> list:
+        """Get the lobbies with a sample within the presence timeout"""
+        present_since = datetime.utcnow() - self.presence_timeout
+        with self.lock:
+            return [lobby_id for lobby_id, lobby in self.lobbies.items() if lobby.last_at >= present_since]
+
+    def load_lobby(self, lobby_id: str, persisted):
+        """Merge persisted latest locations into the lobby and mark it loaded"""
+        present_since = datetime.utcnow() - self.presence_timeout
+        with self.lock:
+            lobby = self._lobby(lobby_id)
+            for latest in persisted:
+                self._apply(lobby, latest)
+                self._mark_written(lobby, latest)
+            lobby.loaded = True
+            return [self._with_group(lobby, latest, present_since) for latest in lobby.users.values()]
+
+    def _occupancy(self, lobby: LobbyState, present_since: datetime) -> dict:
+        rooms = {}
+        for room_id, members in lobby.rooms.items():
+            present = [user_id for user_id in members if lobby.users[user_id].at >= present_since]
+            if present:
+                rooms[room_id] = present
+        return rooms
+
+    def get_occupancy(self, lobby_id: str) -> dict:
+        """Get room_id -> present user ids for a lobby"""
+        present_since = datetime.utcnow() - self.presence_timeout
+        with self.lock:
+            lobby = self.lobbies.get(lobby_id)
+            return self._occupancy(lobby, present_since) if lobby else {}
+
+    def get_occupancy_snapshot(self, lobby_ids) -> dict:
+        """Get lobby_id -> room_id -> present user ids for the given lobbies"""
+        present_since = datetime.utcnow() - self.presence_timeout
+        with self.lock:
+            snapshot = {}
+            for lobby_id in lobby_ids:
+                lobby = self.lobbies.get(lobby_id)
+                snapshot[lobby_id] = self._occupancy(lobby, present_since) if lobby else {}
+            return snapshot
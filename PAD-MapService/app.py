@@ -30,8 +30,15 @@ def get_maps():
 
 @app.route('/maps/<map_id>', methods=['GET'])
 def get_map(map_id):
-    """Get full map details"""
+    """Get full map details (ETag is the map version, If-None-Match gets a 304)"""
     try:
+        # Revalidation only needs the version, not the whole map
+        version = db.get_map_version(map_id)
+        if version is None:
+            return jsonify({'error': 'Map not found'}), 404
+        if request.if_none_match.contains(str(version)):
+            return '', 304, {'ETag': f'"{version}"'}
+        
         map_obj = db.get_map(map_id)
         if not map_obj:
             return jsonify({'error': 'Map not found'}), 404
@@ -39,6 +46,7 @@ def get_map(map_id):
         response = {
             'id': map_obj.id,
             'name': map_obj.name,
+            'version': map_obj.version,
             'rooms': [{'id': r.id, 'name': r.name} for r in map_obj.rooms],
             'connections': [{'from': c.from_room, 'to': c.to_room} for c in map_obj.connections],
             'objects': [{
@@ -54,7 +62,7 @@ def get_map(map_id):
             } for h in map_obj.hiding_spots]
         }
         
-        return jsonify(response), 200
+        return jsonify(response), 200, {'ETag': f'"{map_obj.version}"'}
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -112,7 +120,8 @@ def update_map(map_id):
         
         return jsonify({
             'id': updated_map.id,
-            'name': updated_map.name
+            'name': updated_map.name,
+            'version': updated_map.version
         }), 200
         
     except Exception as e:
@@ -1,5 +1,6 @@
 import psycopg2
 import json
+import uuid
 from psycopg2.extras import RealDictCursor
 from models import Map, Room, Connection, MapObject, HidingSpot
 import os
@@ -72,6 +73,9 @@ class Database:
                         FOREIGN KEY (map_id) REFERENCES maps(id) ON DELETE CASCADE,
                         FOREIGN KEY (room_id) REFERENCES rooms(id) ON DELETE CASCADE
                     );
+
+                    -- Bumped on every change so clients can cache maps and revalidate cheaply
+                    ALTER TABLE maps ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
                 """)
                 self.connection.commit()
                 print("✅ Database tables created")
@@ -174,7 +178,7 @@ class Database:
         try:
             with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
                 # Get map basic info
-                cursor.execute("SELECT id, name, created_at, updated_at FROM maps WHERE id = %s", (map_id,))
+                cursor.execute("SELECT id, name, version, created_at, updated_at FROM maps WHERE id = %s", (map_id,))
                 map_data = cursor.fetchone()
                 
                 if not map_data:
@@ -203,6 +207,7 @@ class Database:
                     connections=connections,
                     objects=objects,
                     hiding_spots=hiding_spots,
+                    version=map_data['version'],
                     created_at=map_data['created_at'].isoformat() + "Z",
                     updated_at=map_data['updated_at'].isoformat() + "Z"
                 )
@@ -210,6 +215,17 @@ class Database:
         except Exception as e:
             raise e
 
+    def get_map_version(self, map_id):
+        """Get the current version of a map, or None if it does not exist"""
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute("SELECT version FROM maps WHERE id = %s", (map_id,))
+                result = cursor.fetchone()
+                return result[0] if result else None
+                
+        except Exception as e:
+            raise e
+
     def create_map(self, map_obj: Map):
         """Create a new map"""
         try:
@@ -239,7 +255,7 @@ class Database:
         try:
             with self.connection.cursor() as cursor:
                 cursor.execute(
-                    "UPDATE maps SET name = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+                    "UPDATE maps SET name = %s, version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
                     (name, map_id)
                 )
                 self.connection.commit()
@@ -42,6 +42,7 @@ class Map:
     connections: List[Connection] = None
     objects: List[MapObject] = None
     hiding_spots: List[HidingSpot] = None
+    version: int = 1
     created_at: str = None
     updated_at: str = None
     